@@ -1,14 +1,22 @@
 # imports
+from pathlib import Path
+import geopandas as gpd
+gpd.options.io_engine = 'pyogrio'  # columnar vector reader/writer for all shapefile I/O in this run
 from Scripts import confinement
+from Scripts.vector_io import prepare_inputs
 
 # directory
-dir = 'data/'
+dir = Path('data')
 
 # Inputs - fill in
-network = dir + '.shp'  # name and extension of drainage network shapefile
-valley = dir + '.shp'  # name and extension of floodplain/valley bottom shapefile
+network = dir / '.shp'  # name and extension of drainage network shapefile
+valley = dir / '.shp'  # name and extension of floodplain/valley bottom shapefile
 
 # run confinement model - do not modify anything below
-inst = confinement.Confinement(network, valley, exag=0.05)
+for f in [network, valley]:
+    if not f.is_file():
+        raise Exception('input file ' + str(f) + ' does not exist, check the inputs')
+
+valley = prepare_inputs(str(valley))  # one-time conversion to a spatially indexed GeoPackage
+inst = confinement.Confinement(str(network), valley, exag=0.05)
 inst.confinement()
-inst.update_area()
@@ -1,15 +1,24 @@
 # imports
+from pathlib import Path
+import geopandas as gpd
+gpd.options.io_engine = 'pyogrio'  # columnar vector reader/writer for all shapefile I/O in this run
 from Scripts import floodplain_area
+from Scripts.vector_io import prepare_inputs
 
 # directory
-dir = 'data/'
+dir = Path('data')
 
 # Inputs - fill in
-network = dir + '.shp'  # name and extension of drainage network shapefile
-floodplain = dir + '.shp'  # name and extension of floodplain/valley bottom shapefile
+network = dir / '.shp'  # name and extension of drainage network shapefile
+floodplain = dir / '.shp'  # name and extension of floodplain/valley bottom shapefile
 lg_buf = 2000  # maximum valley bottom width in high drainage area portions of network
 med_buf = 500  # maximum valley bottom width in medium drainage area portions of network
 sm_buf = 50  # maximum valley bottom width in small drainage area portions of the network
 
 # run model - do not alter
-floodplain_area.extract_floodplain_area(network, floodplain, lg_buf, med_buf, sm_buf)
+for f in [network, floodplain]:
+    if not f.is_file():
+        raise Exception('input file ' + str(f) + ' does not exist, check the inputs')
+
+floodplain = prepare_inputs(str(floodplain))  # one-time conversion to a spatially indexed GeoPackage
+floodplain_area.extract_floodplain_area(str(network), floodplain, lg_buf, med_buf, sm_buf)
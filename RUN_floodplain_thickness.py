@@ -1,15 +1,24 @@
 # imports
+from pathlib import Path
+import geopandas as gpd
+gpd.options.io_engine = 'pyogrio'  # columnar vector reader/writer for all shapefile I/O in this run
 from Scripts import floodplain_thickness
+from Scripts.vector_io import prepare_inputs
 
 # directory
-dir = 'data/'
+dir = Path('data')
 
 # Inputs - fill in
-network = dir + '.shp'  # name and extension of drainage network shapefile
-valley = dir + '.shp'  # name and extension of valley bottom shapefile
-dem = dir + '.tif'  # name and extension of DEM
+network = dir / '.shp'  # name and extension of drainage network shapefile
+valley = dir / '.shp'  # name and extension of valley bottom shapefile
+dem = dir / '.tif'  # name and extension of DEM
 min_thickness = 0.7  # a minimum floodplain thickness value (m)
 max_thickness = 3  # a maximum floodplain thickness value (m)
 
 # run model - do not modify below here
-floodplain_thickness.est_fp_thickness(network, valley, dem, min_thickness, max_thickness)
+for f in [network, valley, dem]:
+    if not f.is_file():
+        raise Exception('input file ' + str(f) + ' does not exist, check the inputs')
+
+valley = prepare_inputs(str(valley))  # one-time conversion to a spatially indexed GeoPackage
+floodplain_thickness.est_fp_thickness(str(network), valley, str(dem), min_thickness, max_thickness)
@@ -1,14 +1,17 @@
 # imports
+from pathlib import Path
+import geopandas as gpd
+gpd.options.io_engine = 'pyogrio'  # columnar vector reader/writer for all shapefile I/O in this run
 from Scripts import sed_delivery_params
 
 # directory
-dir = 'data/'
+dir = Path('data')
 
 # Inputs - fill in
-dem = dir + '.tif'  # name and extension of DEM
-slope_out = dir + '.tif'  # if small DEM (e.g. HUC 12) set calc_slope = True and specify output name and extension,
+dem = dir / '.tif'  # name and extension of DEM
+slope_out = dir / '.tif'  # if small DEM (e.g. HUC 12) set calc_slope = True and specify output name and extension,
                           # otherwise, use GIS to derive slope raster and specify name and extension of that raster.
-network = dir + '.shp'  # name and extension of drainage network shapefile
+network = dir / '.shp'  # name and extension of drainage network shapefile
 neighborhood = 500  # neighborhood distance for calculating local gradient (m)
 g_shape = 8  # gamma shape parameter (for erosion rates)
 g_scale_min = 0.1  # minimum gamma scale parameter (for erosion rates)
@@ -16,4 +19,10 @@ g_scale_max = 0.15  # maximum gamma scale parameter (for erosion rates)
 calc_slope = False  # if DEM is small (e.g. HUC 12) set True and specify output name and extension in slope_out param
 
 # run model - do not modify below here
-sed_delivery_params.SedDeliveryParams(dem, slope_out, network, neighborhood, g_shape, g_scale_min, g_scale_max, calc_slope)
+if __name__ == '__main__':  # slope windows are processed in worker processes
+    inputs = [network, dem] if calc_slope else [network, slope_out]  # slope_out is created from the dem if calc_slope
+    for f in inputs:
+        if not f.is_file():
+            raise Exception('input file ' + str(f) + ' does not exist, check the inputs')
+
+    sed_delivery_params.SedDeliveryParams(str(dem), str(slope_out), str(network), neighborhood, g_shape, g_scale_min, g_scale_max, calc_slope)
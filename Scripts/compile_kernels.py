@@ -0,0 +1,31 @@
+# imports
+from numba import types
+from .dynamic_model import route_level
+
+# argument types of route_level as called by SerfeModel.run_level
+i8, f8 = types.int64, types.float64
+i8_1d, f8_1d, b1_1d = types.int64[::1], types.float64[::1], types.boolean[::1]
+f8_2d, f4_3d = types.float64[:, ::1], types.float32[:, :, ::1]
+
+route_level_sig = (i8_1d, i8, f8_1d, f4_3d, f8_2d, f8_2d, f8_2d, f8_2d, f8_2d,  # segs, time, flow, out and state
+                   f8_1d, f8_1d, f8_1d, f8_1d, f8_1d, f8_1d, f8_1d, f8_1d, f8_1d, f8_1d,  # network attributes
+                   f8_1d, f8_2d, f8_2d, f8_2d, f8_1d,  # n, D0, qc, w_crit, active_layer
+                   i8_1d, i8_1d, f8_1d, f8, b1_1d, f8, f8,  # us1, us2, w_coef, w_int, dam, bulk_dens, fp_n
+                   i8_1d, f8_1d, f8_1d, i8_1d, i8_1d, b1_1d, f8_1d, f8_1d, f8_1d, i8_1d)  # pulse arrays
+
+
+def compile_kernels():
+    """
+    compiles the routing kernel for the argument types the model uses and saves it to the numba cache, so that model
+    runs (e.g. spinup or ensemble runs started in parallel) load the compiled kernel instead of compiling it on the
+    first time step
+    :return:
+    """
+    print('compiling routing kernels')
+    route_level.compile(route_level_sig)
+
+    return
+
+
+if __name__ == '__main__':
+    compile_kernels()
@@ -1,7 +1,25 @@
 #imports
 import geopandas as gpd
 import numpy as np
+import shapely
 from shapely.geometry import LineString
+from .vector_io import read_vector, write_vector, tile_valley
+
+
+def _apply_fp_rule(confine, fp_area):
+    """
+    Fully confined segments have no floodplain, and segments with no floodplain are fully confined.
+    :param confine: array - confinement of each segment.
+    :param fp_area: array - floodplain area of each segment.
+    :return: confinement and floodplain area arrays (float32) with the rule applied.
+    """
+
+    confine = np.asarray(confine, dtype=np.float32).copy()
+    fp_area = np.asarray(fp_area, dtype=np.float32).copy()
+    fp_area[confine == 1.] = 0.
+    confine[fp_area == 0.] = 1.
+
+    return confine, fp_area
 
 
 class Confinement:
@@ -17,66 +35,71 @@ class Confinement:
         width to ensure overlap with the valley bottom polygon. Default = 0.5.
         """
         self.streams = network
-        self.network = gpd.read_file(network)
-        self.valley = gpd.read_file(valley)
+        self.network = read_vector(network)
+        self.valley = read_vector(valley)
         self.exag = exag
+        self.search_dist = 1000.  # distance around each segment within which the valley bottom is considered
 
-        # set confinement value to default nodata
-        self.network['confine'] = -9999
+        # split the valley bottom into tiles about the size of a segment's search area
+        self.tiles = tile_valley(self.valley, self.network.length.mean() + 2*self.search_dist)
+        self.tree = shapely.STRtree(self.tiles.geometry.values)  # built once, queried for all segments
 
-    def calc_confinement(self, seg, buf_width):
+        # set confinement value to default nodata
+        self.network['confine'] = -9999.
 
-        channel = seg.buffer(buf_width)
-        buf = seg.buffer(1000)
-        inters1 = self.valley.loc[0, 'geometry'].intersection(buf)
-        dif = channel.difference(inters1)
-        inters = channel.intersection(inters1)
+    def calc_confinement(self, seg, dif, inters):
+        """
+        Finds the proportion of a segment's banks that are in contact with the valley bottom margin.
+        :param seg: LineString - network segment.
+        :param dif: Polygon or MultiPolygon - the part of the channel buffer outside of the valley bottom.
+        :param inters: Polygon or MultiPolygon - the part of the channel buffer inside the valley bottom.
+        :return: float - confinement value (0 - 1).
+        """
 
-        if dif.type == 'Polygon':
-            if dif.exterior is None:
-                return 0
+        if dif.is_empty:
+            return 0
 
         if inters.area == 0.:
             return 1
 
         else:
-            if inters.type == 'MultiPolygon':
-                int_coords = []
-                for i in range(len(inters)):
-                    for j in range(len(inters[i].exterior.xy[0])):
-                        int_coords_x = inters[i].exterior.xy[0][j]
-                        int_coords_y = inters[i].exterior.xy[1][j]
-                        int_coords.append([int_coords_x, int_coords_y])
-            elif inters.type == 'Polygon':
-                int_coords = []
+            if inters.geom_type == 'MultiPolygon':
+                int_coords = set()
+                for i in range(len(inters.geoms)):
+                    for j in range(len(inters.geoms[i].exterior.xy[0])):
+                        int_coords_x = inters.geoms[i].exterior.xy[0][j]
+                        int_coords_y = inters.geoms[i].exterior.xy[1][j]
+                        int_coords.add((int_coords_x, int_coords_y))
+            elif inters.geom_type == 'Polygon':
+                int_coords = set()
                 for i in range(len(inters.exterior.xy[0])):
                     int_coords_x = inters.exterior.xy[0][i]
                     int_coords_y = inters.exterior.xy[1][i]
-                    int_coords.append([int_coords_x, int_coords_y])
+                    int_coords.add((int_coords_x, int_coords_y))
             else:
-                int_coords = []
+                int_coords = set()
 
-            if dif.type == 'MultiPolygon':
+            if dif.geom_type == 'MultiPolygon':
                 line_len = []
-                for i in range(len(dif)):
+                for i in range(len(dif.geoms)):
                     line_coords = []
-                    for j in range(len(dif[i].exterior.xy[0])):
-                        dif_coords_x = dif[i].exterior.xy[0][j]
-                        dif_coords_y = dif[i].exterior.xy[1][j]
-                        if [dif_coords_x, dif_coords_y] in int_coords:
+                    for j in range(len(dif.geoms[i].exterior.xy[0])):
+                        dif_coords_x = dif.geoms[i].exterior.xy[0][j]
+                        dif_coords_y = dif.geoms[i].exterior.xy[1][j]
+                        if (dif_coords_x, dif_coords_y) in int_coords:
                             line_coords.append([dif_coords_x, dif_coords_y])
                     if len(line_coords) > 1:
                         line = LineString(line_coords)
                         line_len.append(line.length)
                     else:
                         line_len = []
-            elif dif.type == 'Polygon':
+            elif dif.geom_type == 'Polygon':
                 line_len = []
                 line_coords = []
                 for y in range(len(dif.exterior.xy[0])):
                     dif_coords_x = dif.exterior.xy[0][y]
                     dif_coords_y = dif.exterior.xy[1][y]
-                    if [dif_coords_x, dif_coords_y] in int_coords:
+                    if (dif_coords_x, dif_coords_y) in int_coords:
                         line_coords.append([dif_coords_x, dif_coords_y])
                 if len(line_coords) > 1:
                     line = LineString(line_coords)
@@ -95,30 +118,45 @@ class Confinement:
 
     def confinement(self):
 
-        for i in self.network.index:
+        # clip the valley bottom to each segment's search area using only the tiles that the search area touches
+        search = self.network.geometry.buffer(self.search_dist).values
+        seg_ids, tile_ids = self.tree.query(search, predicate='intersects')
+        pieces = shapely.intersection(search[seg_ids], self.tiles.geometry.values[tile_ids])
+        local_valley = gpd.GeoDataFrame({'seg': seg_ids}, geometry=pieces, crs=self.network.crs)
+        local_valley = local_valley.dissolve('seg', grid_size=1e-6).geometry  # snap to close seams between tiles
+
+        # buffer all segments by their channel width and split the buffers on the valley bottom in one pass
+        buf_width = (self.network['w_bf'].to_numpy()/2) + (self.network['w_bf'].to_numpy()*self.exag)
+        channel = shapely.buffer(self.network.geometry.values, buf_width, quad_segs=16)
+        valley = local_valley.reindex(self.network.index).fillna(shapely.Polygon()).values
+        dif = shapely.difference(channel, valley)
+        inters = shapely.intersection(channel, valley)
+
+        confine = np.empty(len(self.network.index), dtype=np.float32)  # derived stats don't need double precision
+        for i in range(len(self.network.index)):
             print('segment ', i+1, ' of ', len(self.network.index))
-            seg = self.network.loc[i, 'geometry']
-            buf_width = (self.network.loc[i, 'w_bf']/2) + (self.network.loc[i, 'w_bf']*self.exag)
+            confine[i] = self.calc_confinement(self.network.geometry.iloc[i], dif[i], inters[i])
 
-            conf_val = self.calc_confinement(seg, buf_width)
+        if 'fp_area' in self.network.columns:
+            confine, self.network['fp_area'] = _apply_fp_rule(confine, self.network['fp_area'])
 
-            self.network.loc[i, 'confine'] = conf_val
+        self.network['confine'] = confine
 
-        self.network.to_file(self.streams)
+        write_vector(self.network, self.streams)
 
         return
 
     def update_area(self):
+        """
+        Sets floodplain area to 0 for fully confined segments and confinement to 1 for segments with no floodplain,
+        and writes the network. confinement() already applies this rule when the network has an 'fp_area' field, so
+        this is only needed if floodplain area was added to the network after confinement was run.
+        :return:
+        """
 
-        network = gpd.read_file(self.streams)
-
-        for i in network.index:
-            if network.loc[i, 'confine'] == 1.:
-                network.loc[i, 'fp_area'] = 0.
-
-            if network.loc[i, 'fp_area'] == 0.:
-                network.loc[i, 'confine'] = 1.
+        self.network['confine'], self.network['fp_area'] = _apply_fp_rule(self.network['confine'],
+                                                                          self.network['fp_area'])
 
-        network.to_file(self.streams)
+        write_vector(self.network, self.streams)
 
         return
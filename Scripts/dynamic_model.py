@@ -2,16 +2,564 @@
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+from numba import njit, prange
 from .network_topology import TopologyTools
 from sklearn import linear_model
 
+# network attributes used by the model, 'Slope_*', 'fpt_*' and 'denude' are model state and change during a run
+net_cols = ['Drain_Area', 'eff_DA', 'direct_DA', 'denude', 'confine', 'fp_area', 'fpt_min', 'fpt_mid', 'fpt_max',
+            'w_bf', 'Length_m', 'Slope_min', 'Slope_mid', 'Slope_max', 'D_pred_mid', 'D_pred_low', 'D_pred_hig',
+            'Qc_low', 'Qc_mid', 'Qc_high', 'Sinuos', 'dist_start', 'dist_end', 'dist_d50', 'dist_g_sh', 'dist_g_sc',
+            'g_shape', 'g_scale']
+
+# output attributes and their position along the last axis of the output array
+out_cols = ['Q', 'Qs_min', 'Qs_mid', 'Qs_max', 'Qs_out_min', 'Qs_out_mid', 'Qs_out_max', 'CSR_min', 'CSR_mid', 'CSR_max',
+            'Store_chan_min', 'Store_chan_mid', 'Store_chan_max', 'Store_tot_min', 'Store_tot_mid', 'Store_tot_max',
+            'Store_delta_min', 'Store_delta_mid', 'Store_delta_max']
+out_ix = {col: i for i, col in enumerate(out_cols)}
+
+# first column of each attribute group in the output array (the min, mid and max cases follow in order)
+col_q, col_qs, col_qs_out, col_csr = out_ix['Q'], out_ix['Qs_min'], out_ix['Qs_out_min'], out_ix['CSR_min']
+col_store_chan, col_store_tot, col_store_delta = out_ix['Store_chan_min'], out_ix['Store_tot_min'], out_ix['Store_delta_min']
+
+# dimensionless critical stream power for the min, mid and max capacity cases
+om_crit_star = np.array([0.11, 0.1, 0.09])
+
+# suspended grain size (m) settling onto the floodplain for the min, mid and max capacity cases and its settling velocity
+settling_d = np.array([0.0008, 0.0005, 0.0003])
+settling_w = (16.17*settling_d**2)/(1.8e-5+(12.1275*settling_d**3)**0.5)
+
+
+@njit(cache=True, error_model='numpy')
+def transport_capacity(Q, w, S, D, om_crit_star):
+    """
+    calculates bedload transport capacity using Lammers and Bledsoe 2018
+    :param Q: flow (cms)
+    :param w: channel width
+    :param S: bed slope
+    :param D: median grain size
+    :param om_crit_star: dimensionless critical stream power
+    :return: bedload transport capacity (tonnes)
+    """
+    # variables
+    rho = 1000.
+    rho_s = 2650.
+    g = 9.8
+    om_crit = om_crit_star * g * (rho_s - rho) * np.sqrt(((rho_s - rho)/rho) * g * D**3)
+
+    # determine if stream power exceeds critical threshold
+    om = (rho * g * Q * S) / w
+
+    if om > om_crit:
+        rate_tot = 0.0214 * (om - om_crit) ** (3. / 2.) * D ** (-1) * (Q / w) ** (-5. / 6.)  # Lammers et al total load equation (tonnes)
+        cap_tot = (Q * 86400) * (rate_tot / 1000000.) * 2.6  # convert ppm to tonnes/day
+    else:
+        cap_tot = 0.
+
+    return cap_tot  # add in bl stuff later
+
+
+@njit(cache=True, error_model='numpy')
+def transport_capacity_lanes(Q, w, S, D, om_crit_star):
+    """
+    calculates transport capacity for the min, mid and max capacity cases in one call
+    :param Q: flow (cms)
+    :param w: channel width
+    :param S: array - bed slope for each case
+    :param D: array - median grain size for each case
+    :param om_crit_star: array - dimensionless critical stream power for each case
+    :return: array - transport capacity (tonnes) for each case
+    """
+    cap = np.empty(len(S))
+    for i in range(len(S)):
+        cap[i] = transport_capacity(Q, w, S[i], D[i], om_crit_star[i])
+
+    return cap
+
+
+@njit(cache=True, error_model='numpy')
+def route_cases_confined(load, cap, transport_rem, qsout):
+    """
+    sediment routing logic of a confined reach (no floodplain exchange) for the min, mid and max capacity cases
+    :param load: array - sediment load (tonnes)
+    :param cap: array - transport capacity (tonnes)
+    :param transport_rem: array - transport capacity remaining after moving disturbance sediment
+    :param qsout: array - disturbance sediment moved out of the reach (tonnes)
+    :return: arrays - sediment flux out (tonnes), channel storage (tonnes), capacity to supply ratio and whether the
+    load equals the transport capacity
+    """
+    qs_out, channel_store, csr = np.empty(3), np.zeros(3), np.empty(3)
+    balanced = np.zeros(3, dtype=np.bool_)
+
+    for k in range(3):
+        if transport_rem[k] < load[k] - qsout[k]:  # greater sediment load than transport capacity
+            if k == 0:
+                qs_out[k] = transport_rem[k] + qsout[k]  # min case uses remaining capacity
+            else:
+                qs_out[k] = cap[k] + qsout[k]
+            channel_store[k] = load[k] - qs_out[k]
+        elif transport_rem[k] > load[k] - qsout[k]:  # greater transport capacity than sediment load
+            qs_out[k] = load[k] + qsout[k]
+        else:  # sediment load equals transport capacity
+            qs_out[k] = load[k]
+            csr[k] = 1.
+            balanced[k] = True
+            continue
+
+        if load[k] == 0:
+            if cap[k] > 0:
+                csr[k] = cap[k]
+            else:
+                csr[k] = 1.
+        else:
+            csr[k] = cap[k] / load[k]
+
+    return qs_out, channel_store, csr, balanced
+
+
+@njit(cache=True, error_model='numpy')
+def route_cases_unconfined(load, cap, transport_rem, qsout, S, fpt, depth, fp_store, fp_thick, mig_rate, qs_us, w, n,
+                           w_bf, length, fp_area, confine, bulk_dens, fp_n):
+    """
+    sediment routing logic of an unconfined reach (sediment exchange with the floodplain) for the min, mid and max
+    capacity cases
+    :param load: array - sediment load (tonnes)
+    :param cap: array - transport capacity (tonnes)
+    :param transport_rem: array - transport capacity remaining after moving disturbance sediment
+    :param qsout: array - disturbance sediment moved out of the reach (tonnes)
+    :param S: array - channel slope
+    :param fpt: array - floodplain thickness at the start of the time step
+    :param depth: array - flow depth
+    :param fp_store: array - floodplain storage (tonnes)
+    :param fp_thick: array - floodplain thickness including the hillslope input (m)
+    :param mig_rate: array - channel migration rate
+    :param qs_us: array - sediment flux from upstream (tonnes)
+    :return: arrays - sediment flux out (tonnes), channel storage (tonnes), capacity to supply ratio, whether the load
+    equals the transport capacity, floodplain storage (tonnes) and floodplain thickness (m)
+    """
+    qs_out, channel_store, csr = np.empty(3), np.zeros(3), np.empty(3)
+    balanced = np.zeros(3, dtype=np.bool_)
+    fp_store_k, fp_thick_k = fp_store.copy(), fp_thick.copy()
+    inv_bd = 1. / bulk_dens
+    inv_fp_area = 1. / fp_area
+
+    for k in range(3):
+        d = depth[k]
+
+        if transport_rem[k] < load[k] - qsout[k]:  # greater sediment load than transport capacity
+            if k == 0:
+                qs_out[k] = transport_rem[k] + qsout[k]  # min case uses remaining capacity
+            else:
+                qs_out[k] = cap[k] + qsout[k]
+            if d < fp_thick_k[k]:  # depth is less than floodplain height
+                channel_store[k] = load[k] - qs_out[k]
+            else:  # depth is greater than floodplain height
+                vol_channel = d * length * min(w, w_bf)
+                vol_fp = (d - fp_thick_k[k])*fp_area
+                d_cbrt, d_fp_cbrt = np.cbrt(d), np.cbrt(d - fp_thick_k[k])
+                v_chan = (d_cbrt * d_cbrt * np.sqrt(S[k])) / n
+                v_fp = (d_fp_cbrt * d_fp_cbrt * np.sqrt(S[k])) / fp_n
+                v_ratio = v_fp / v_chan
+                fp_ratio = vol_fp*v_ratio / ((vol_channel + vol_fp)-(vol_fp*v_ratio))  # correct volumes for velocity
+                sed_remain = load[k] - qs_out[k]
+                channel_store[k] = sed_remain * (1-fp_ratio)
+                fp_store_k[k] = fp_store_k[k] + (sed_remain - channel_store[k])
+                fp_thick_k[k] = fp_store_k[k] * inv_fp_area * inv_bd
+
+            if load[k] == 0:
+                if cap[k] > 0:
+                    csr[k] = cap[k]
+                else:
+                    csr[k] = 1.
+            else:
+                csr[k] = cap[k] / load[k]
+
+        elif transport_rem[k] > load[k] - qsout[k]:  # greater transport capacity than sediment load
+            fp_recr = min((mig_rate[k] * 86400) * (length * (1 - confine)) * fp_thick_k[k] * bulk_dens, fp_area * fpt[k] * bulk_dens)  # set up as 1 DAY TIME STEP
+            if d >= fp_thick_k[k]:
+                vol_channel = d * length * min(w, w_bf)
+                vol_fp = (d - fp_thick_k[k]) * fp_area
+                d_cbrt, d_fp_cbrt = np.cbrt(d), np.cbrt(d - fp_thick_k[k])
+                v_chan = (d_cbrt * d_cbrt * np.sqrt(S[k])) / n
+                v_fp = (d_fp_cbrt * d_fp_cbrt * np.sqrt(S[k])) / fp_n
+                v_ratio = v_fp / v_chan
+                fp_ratio = vol_fp * v_ratio / ((vol_channel + vol_fp) - (vol_fp * v_ratio))  # correct volumes for velocity
+                w_s = settling_w[k]  # suspended grain size for this trajectory
+                fp_v_ratio = min(w_s/v_fp, 0.01)  # 1 percent minimum
+                fp_recr = fp_recr - (qs_us[0]*fp_ratio*fp_v_ratio)
+            qs_out[k] = load[k] + fp_recr + qsout[k]
+            fp_store_k[k] = fp_store_k[k] - fp_recr
+            fp_recr_thick = fp_recr * inv_fp_area * inv_bd
+            fp_thick_k[k] = max(0., fp_thick_k[k] - fp_recr_thick)
+
+            if load[k] + fp_recr == 0:
+                if cap[k] > 0:
+                    csr[k] = cap[k]
+                else:
+                    csr[k] = 1.
+            else:
+                csr[k] = cap[k] / (load[k] + fp_recr)
+
+        else:  # sediment load equals transport capacity
+            qs_out[k] = load[k]
+            csr[k] = 1.
+            balanced[k] = True
+
+    return qs_out, channel_store, csr, balanced, fp_store_k, fp_thick_k
+
+
+@njit(cache=True, error_model='numpy')
+def route_reach(segid, time, out, slope, fpt, sed_out, ch_store, tot_store, flow, w, n, depth, qs_channel, qs_us,
+                prev_ch_store, fp_store, fp_thick, cap, transport_rem, qsout, mig_rate, w_bf, length, fp_area, confine,
+                dam, bulk_dens, fp_n):
+    """
+    applies the sediment routing logic to a reach for the min, mid and max capacity cases, updates the slope and
+    floodplain thickness of the reach and writes the outputs for the time step
+    :param segid: segment ID
+    :param time: time step
+    :param out: output array (time step x segment x attribute)
+    :param slope: array - channel slope of each segment (segment x case), updated in place
+    :param fpt: array - floodplain thickness of each segment (segment x case), updated in place
+    :param sed_out: array - sediment flux out of each segment in the time step (segment x case), updated in place
+    :param ch_store: array - channel storage of each segment (segment x case), updated in place
+    :param tot_store: array - total storage of each segment (segment x case), updated in place
+    :param flow: flow (cms)
+    :param w: channel width
+    :param n: Manning's n
+    :param depth: array - flow depth for each case
+    :param qs_channel: hillslope sediment delivered to the channel (tonnes)
+    :param qs_us: array - sediment flux from upstream for each case (tonnes)
+    :param prev_ch_store: array - channel storage at the previous time step for each case (tonnes)
+    :param fp_store: array - floodplain storage for each case (tonnes)
+    :param fp_thick: array - floodplain thickness for each case (m)
+    :param cap: array - transport capacity for each case (tonnes)
+    :param transport_rem: array - transport capacity remaining after moving disturbance sediment for each case
+    :param qsout: array - disturbance sediment moved out of the reach for each case (tonnes)
+    :param mig_rate: array - channel migration rate for each case
+    :param w_bf: bankfull width
+    :param length: segment length
+    :param fp_area: floodplain area
+    :param confine: confinement
+    :param dam: boolean - True if the segment drains into a dam
+    :param bulk_dens: sediment (floodplain) deposit bulk density
+    :param fp_n: floodplain Manning's n
+    :return:
+    """
+    # output row for the reach, written to the output table once all cases are done
+    row = np.empty(out.shape[2])
+    row[col_q] = flow
+
+    # constants for converting sediment mass to deposit thickness
+    inv_bd = 1. / bulk_dens
+    inv_bed_area = 1. / (0.5 * w_bf * length)
+    inv_len = 1. / length
+
+    # confinement doesn't change through a run, so confined and unconfined reaches each get their own routing logic
+    load = qs_channel + qs_us + prev_ch_store
+    if confine == 1.:
+        qs_out_k, channel_store_k, csr_k, balanced_k = route_cases_confined(load, cap, transport_rem, qsout)
+        fp_store_k, fp_thick_k = fp_store, fp_thick
+    else:
+        qs_out_k, channel_store_k, csr_k, balanced_k, fp_store_k, fp_thick_k = \
+            route_cases_unconfined(load, cap, transport_rem, qsout, slope[segid], fpt[segid], depth, fp_store,
+                                   fp_thick, mig_rate, qs_us, w, n, w_bf, length, fp_area, confine, bulk_dens, fp_n)
+
+    for k in range(3):
+        qs_out, channel_store, csr = qs_out_k[k], channel_store_k[k], csr_k[k]
+
+        # change in bed elevation from the change in channel storage, written back to the slope once
+        if not balanced_k[k]:
+            delta_h = (channel_store - prev_ch_store[k]) * inv_bd * inv_bed_area
+            slope[segid, k] = slope[segid, k] + delta_h * inv_len
+
+        # if you are at a dam, qs_out = 0
+        if dam:
+            qs_out = 0.
+
+        store_tot = channel_store + fp_store_k[k]
+
+        if confine != 1.:
+            fpt[segid, k] = fp_thick_k[k]
+
+        if time > 1:
+            store_delta = store_tot - tot_store[segid, k]
+        else:
+            store_delta = 0.  # this is wrong channel storage can change day 1
+
+        # update state (kept at full precision) and output table
+        sed_out[segid, k] = qs_out
+        ch_store[segid, k] = channel_store
+        tot_store[segid, k] = store_tot
+        row[col_qs + k] = load[k]
+        row[col_qs_out + k] = qs_out
+        row[col_csr + k] = csr
+        row[col_store_tot + k] = store_tot
+        row[col_store_chan + k] = channel_store
+        row[col_store_delta + k] = store_delta
+
+    out[time, segid, :] = row
+
+    return
+
+
+@njit(cache=True)
+def sort_pulses(mass, dist, src, start, stop):
+    """
+    sorts sediment pulses in place by travel distance (insertion sort, stable and fast for the few pulses in a segment)
+    :param mass: array - pulse mass
+    :param dist: array - pulse travel distance
+    :param src: array - pulse source position
+    :param start: first position of the pulses to sort
+    :param stop: position after the last pulse to sort
+    :return:
+    """
+    for j in range(start + 1, stop):
+        m, d, o = mass[j], dist[j], src[j]
+        i = j - 1
+        while i >= start and dist[i] > d:
+            mass[i+1], dist[i+1], src[i+1] = mass[i], dist[i], src[i]
+            i -= 1
+        mass[i+1], dist[i+1], src[i+1] = m, d, o
+
+    return
+
+
+@njit(cache=True)
+def update_pulse_store(segid, qs_channel, travel, us_segs, pulse_ptr, pulse_mass, pulse_dist, pulse_src, pulse_n,
+                       pulse_empty, pulse_total, out_mass, out_dist, out_n):
+    """
+    updates the disturbance sediment pulses in a segment: pulses left over from the previous time step and the hillslope
+    input are lumped into one store with a new travel distance and the pulses leaving the upstream segments are added,
+    sorted by travel distance. the pulses of segment i are stored in [pulse_ptr[i]:pulse_ptr[i]+pulse_n[i]] of the pulse
+    arrays and the pulses leaving it in [pulse_ptr[i]:pulse_ptr[i]+out_n[i]] of the out arrays
+    :param segid: segment ID
+    :param qs_channel: hillslope sediment delivered to the channel (tonnes)
+    :param travel: distance the lumped store can travel in the time step
+    :param us_segs: array - adjacent upstream segment IDs
+    :param pulse_src: array - position in the out arrays that each pulse came from (-1 for the lumped store)
+    :param pulse_empty: array - True if the segment holds no disturbance sediment
+    :param pulse_total: array - total mass of the disturbance sediment pulses in the segment after the update
+    :return:
+    """
+    p = pulse_ptr[segid]
+
+    # add up stores left over from previous time step
+    store_sum = 0.
+    for j in range(p, p + pulse_n[segid]):
+        store_sum += pulse_mass[j]
+    store_sum += qs_channel
+    if store_sum < 0:
+        store_sum = 0.
+    pulse_mass[p], pulse_dist[p], pulse_src[p] = store_sum, travel, -1
+    n = 1
+
+    for us in us_segs:
+        for q in range(pulse_ptr[us], pulse_ptr[us] + out_n[us]):
+            pulse_mass[p+n], pulse_dist[p+n], pulse_src[p+n] = out_mass[q], out_dist[q], q
+            n += 1
+
+    sort_pulses(pulse_mass, pulse_dist, pulse_src, p, p + n)
+
+    total = 0.
+    for j in range(p, p + n):
+        total += pulse_mass[j]
+    if total == 0:
+        pulse_mass[p], pulse_dist[p], pulse_src[p] = 0., 0., -1
+        n = 1
+    pulse_n[segid] = n
+    pulse_empty[segid] = total == 0
+    pulse_total[segid] = total
+
+    return
+
+
+@njit(cache=True)
+def propagate_pulses(segid, transport, length, pulse_ptr, pulse_mass, pulse_dist, pulse_src, pulse_n, pulse_empty,
+                     out_mass, out_dist, out_n):
+    """
+    moves disturbance sediment pulses out of a segment with the available transport capacity. pulses that came from an
+    upstream segment share their mass with that segment's out arrays
+    :param segid: segment ID
+    :param transport: transport capacity (tonnes)
+    :param length: segment length
+    :return: disturbance sediment moved out of the segment (tonnes), remaining transport capacity
+    """
+    qs_out = 0.
+
+    if not pulse_empty[segid]:
+        p = pulse_ptr[segid]
+        m = p
+        if transport > 0:
+            for j in range(p, p + pulse_n[segid]):
+                if transport >= pulse_mass[j]:
+                    if pulse_dist[j] - length > 0:
+                        out_mass[m], out_dist[m] = pulse_mass[j], pulse_dist[j] - length
+                        m += 1
+                        qs_out += pulse_mass[j]
+                        transport = transport - pulse_mass[j]
+                        pulse_mass[j] = 0.
+                else:
+                    out_mass[m], out_dist[m] = transport, pulse_dist[j] - length
+                    m += 1
+                    qs_out += transport
+                    pulse_mass[j] = pulse_mass[j] - transport
+                    transport = 0.
+                if pulse_src[j] >= 0:
+                    out_mass[pulse_src[j]] = pulse_mass[j]
+        out_n[segid] = m - p
+
+    return qs_out, transport
+
+
+@njit(cache=True, error_model='numpy')
+def reach_inputs(segid, time, flow, drain_area, confine, w_bf, fp_area, direct_da, denude, length, dist_start,
+                 dist_d50, sinuos, n_seg, D0, qc, w_crit, active_layer, slope, fpt, sed_out, ch_store, us1, us2, w_coef,
+                 w_int, bulk_dens, pulse_ptr, pulse_mass, pulse_dist, pulse_src, pulse_n, pulse_empty, pulse_total,
+                 out_mass, out_dist, out_n):
+    """
+    finds the width, sediment inputs and transport capacity of a given reach (inputs to the routing logic) and moves
+    disturbance sediment pulses through it. network attributes and model state are arrays indexed by segment id
+    :param segid: segment ID
+    :param time: time step
+    :param flow: flow (cms) at the reach at the time step
+    :return: width, Manning's n, hillslope sediment delivered to the channel and arrays (min, mid, max case) of depth,
+    upstream sediment flux, previous channel storage, floodplain storage, floodplain thickness, transport capacity,
+    remaining transport capacity, disturbance sediment out and migration rate
+    """
+    w_bf_seg, confine_seg, fp_area_seg = w_bf[segid], confine[segid], fp_area[segid]
+
+    # get channel width of reach at given time step
+    w = max(w_coef[0]*np.log(drain_area[segid]) + w_coef[1]*np.sqrt(flow) + w_int, 0.5)  # 0.5 m min width
+    if confine_seg == 1:
+        if w > w_bf_seg:
+            w = w_bf_seg
+
+    # mannings n calculation of depth
+    n = n_seg[segid]
+
+    # slope for the min, mid and max cases
+    S = slope[segid].copy()
+    depth = ((n * flow) / (w * S**0.5))**0.6
+
+    # find upstream qs input
+    qs_us = np.zeros(3)
+    if us1[segid] != -1:
+        qs_us = qs_us + sed_out[us1[segid]]
+    if us2[segid] != -1:
+        qs_us = qs_us + sed_out[us2[segid]]
+
+    # find direct qs input (hillslopes), assumes sediment bulk density of 2.6 tonne/m^3
+    hillslope_da = direct_da[segid] - (fp_area_seg/1000000.)
+    if hillslope_da < 0:
+        hillslope_da = direct_da[segid]*0.5
+    vol_sed = ((denude[segid]/1000.)/365.)*(hillslope_da*1000000.)  # m^3; assumes daily time step
+    qs_dir = vol_sed * 2.6  # tonnes
+
+    if fp_area_seg != 0.:
+        if direct_da[segid] <= 3:  # logic to sure trib contributions not in network go to channel
+            qs_channel = qs_dir*confine_seg
+            qs_fp = qs_dir - qs_channel  # tonnes
+        else:
+            qs_channel = max(0.8*qs_dir, qs_dir*confine_seg)
+            qs_fp = qs_dir - qs_channel
+        fp_store = ((fp_area_seg*fpt[segid])*bulk_dens) + qs_fp
+        delta_fp_thick = qs_fp / fp_area_seg * (1 / bulk_dens)
+        fp_thick = fpt[segid] + delta_fp_thick  # meters
+    else:
+        qs_channel = qs_dir
+        fp_store, fp_thick = np.zeros(3), np.zeros(3)
+
+    # if its during disturbance period keep track of sediment pulse mass
+    disturbed = dist_start[segid] != -9999 and dist_start[segid] <= time
+    if disturbed:
+        d_cbrt = np.cbrt(depth[1])
+        vel = (d_cbrt * d_cbrt * np.sqrt(S[1])) / n
+        us_segs = np.array([us1[segid], us2[segid]])
+        update_pulse_store(segid, qs_channel, vel*86400-length[segid], us_segs[us_segs != -1], pulse_ptr, pulse_mass,
+                           pulse_dist, pulse_src, pulse_n, pulse_empty, pulse_total, out_mass, out_dist, out_n)
+
+    # channel storage at the end of the previous time step (initial channel storage at the first time step)
+    prev_ch_store = ch_store[segid].copy()
+
+    # find transport capacity (including uncertainty in critical dimensionless stream power)
+    # grain size for the min, mid and max cases (high, mid and low D)
+    D = D0[segid].copy()
+    # if there's fine sediment inputs in the channel adjust D based on proportional volume
+    fine_tot = pulse_total[segid] if disturbed else 0.
+    if fine_tot > 0:
+        coarse = np.maximum(prev_ch_store-fine_tot, active_layer[segid])
+        fine_ratio = fine_tot/(fine_tot + coarse)
+        coarse_ratio = coarse/(coarse + fine_tot)
+        D = D*coarse_ratio + (dist_d50[segid] / 1000.)*fine_ratio
+    cap = transport_capacity_lanes(flow, min(w, w_bf_seg), S, D, om_crit_star)
+
+    # mig_rate (could change this to just find critical unit SP using dimensionless critical SP = 0.1...)
+    sp_crit = (9810 * qc[segid] * S) / w_crit[segid]
+    excess_sp = ((9810*flow*S)/w) - sp_crit*4.2
+    wc = sp_crit * 4.2  # 1.2 is soil critical sp param, MAKE THIS PARAM
+    k = 4.49E-6 + 1.74E-7*wc - 4.56E-6*sinuos[segid]
+    mig_rate = np.where(excess_sp <= 0, 0., k*np.maximum(excess_sp, 0.)**0.5)
+
+    qsout = np.zeros(3)
+    transport_rem = cap.copy()
+    if disturbed:
+        for c in (0, 2, 1):  # min, max, mid
+            qsout[c], transport_rem[c] = propagate_pulses(segid, cap[c], length[segid], pulse_ptr, pulse_mass,
+                                                          pulse_dist, pulse_src, pulse_n, pulse_empty, out_mass,
+                                                          out_dist, out_n)
+
+    return w, n, depth, qs_channel, qs_us, prev_ch_store, fp_store, fp_thick, cap, transport_rem, qsout, mig_rate
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def route_level(segs, time, flow, out, slope, fpt, sed_out, ch_store, tot_store, drain_area, confine, w_bf, fp_area,
+                direct_da, denude, length, dist_start, dist_d50, sinuos, n_seg, D0, qc, w_crit, active_layer, us1, us2,
+                w_coef, w_int, dam, bulk_dens, fp_n, pulse_ptr, pulse_mass, pulse_dist, pulse_src, pulse_n, pulse_empty,
+                pulse_total, out_mass, out_dist, out_n):
+    """
+    runs the model (reach_inputs and route_reach) in parallel for a set of segments that do not drain into each
+    other. a segment only writes its own rows of the state arrays (and the pulses leaving its adjacent upstream
+    segments, which drain only into it), so the segments can be processed in any order
+    :param segs: array - segment IDs
+    :param time: time step
+    :param flow: array - flow (cms) at each segment at the time step
+    :return:
+    """
+    for i in prange(len(segs)):
+        segid = segs[i]
+        w, n, depth, qs_channel, qs_us, prev_ch_store, fp_store, fp_thick, cap, transport_rem, qsout, mig_rate = \
+            reach_inputs(segid, time, flow[segid], drain_area, confine, w_bf, fp_area, direct_da, denude, length,
+                         dist_start, dist_d50, sinuos, n_seg, D0, qc, w_crit, active_layer, slope, fpt, sed_out,
+                         ch_store, us1, us2, w_coef, w_int, bulk_dens, pulse_ptr, pulse_mass, pulse_dist, pulse_src,
+                         pulse_n, pulse_empty, pulse_total, out_mass, out_dist, out_n)
+
+        # apply transport/routing logic for the min, mid and max capacity cases
+        route_reach(segid, time, out, slope, fpt, sed_out, ch_store, tot_store, flow[segid], w, n, depth, qs_channel,
+                    qs_us, prev_ch_store, fp_store, fp_thick, cap, transport_rem, qsout, mig_rate, w_bf[segid],
+                    length[segid], fp_area[segid], confine[segid], dam[segid], bulk_dens, fp_n)
+
+    return
+
+
+def to_csr(lists):
+    """
+    packs a list of lists of segment ids into compressed sparse row arrays
+    :param lists: list of lists of ints
+    :return: indptr, indices arrays (the ids in list i are indices[indptr[i]:indptr[i+1]])
+    """
+    indptr = np.zeros(len(lists)+1, dtype=np.int32)
+    indptr[1:] = np.cumsum([len(l) for l in lists])
+    indices = np.array([x for l in lists for x in l], dtype=np.int32)
+
+    return indptr, indices
+
 
 class SerfeModel:
     """
     This class runs the dynamic sediment balance model
     """
 
-    def __init__(self, hydrograph, width_table, flow_exp, network, mannings_min=0.03, mannings_max=0.06, bulk_dens=1., chan_store=None):
+    def __init__(self, hydrograph, width_table, flow_exp, network, mannings_min=0.03, mannings_max=0.06, bulk_dens=1., chan_store=None, seed=None):
         """
 
         :param hydrograph: csv file containing flow information for each gage.
@@ -21,6 +569,7 @@ class SerfeModel:
         :param mannings_min: minimum Manning's n value for the basin.
         :param mannings_max: maximum Manning's n value for the basin.
         :param bulk_dens: sediment (floodplain) deposit bulk density for the basin.
+        :param seed: seed for the random number generator used for denudation rates (None for a random seed).
         """
 
         print('initiating model')
@@ -31,6 +580,7 @@ class SerfeModel:
         self.bulk_dens = bulk_dens
         self.streams = network
         self.fp_n = 0.09  # make param
+        self.rng = np.random.default_rng(seed)
         if chan_store is not None:
             self.chan_store = np.load(chan_store)
         else:
@@ -38,58 +588,156 @@ class SerfeModel:
 
         self.nt = TopologyTools(network)
 
-        # append column to hydrographs indicating what other gages are downstream of it
-        gage_ds = []
-        for gage in self.hydrographs.index:
-            if self.hydrographs.loc[gage, 'segid'] == -9999:
-                gage_ds.append(0)
-            else:
-                ds_segs = self.nt.find_all_ds(self.hydrographs.loc[gage, 'segid'])
-                if len(set(ds_segs) & set(self.hydrographs['segid'])) > 0:
-                    gage_ds.append(len(set(ds_segs) & set(self.hydrographs['segid'])))
-                else:
-                    gage_ds.append(0)
+        print('storing topology info')
+        # upstream and downstream segments of each segment in compressed sparse row form (segments of segment i are
+        # indices[indptr[i]:indptr[i+1]])
+        us_segs = [self.nt.find_all_us(i) for i in self.network.index]
+        ds_segs = [self.nt.find_all_ds(i) for i in self.network.index]
+        self.us_indptr, self.us_indices = to_csr(us_segs)
+        self.ds_indptr, self.ds_indices = to_csr(ds_segs)
+
+        # adjacent upstream segments of each segment (-1 if there is none)
+        self.us1 = np.array([-1 if x is None else x for x in map(self.nt.find_us_seg, self.network.index)], dtype=np.int64)
+        self.us2 = np.array([-1 if x is None else x for x in map(self.nt.find_us_seg2, self.network.index)], dtype=np.int64)
+        adj_us = [[x for x in (u1, u2) if x != -1] for u1, u2 in zip(self.us1, self.us2)]
+
+        # group segments into levels, each segment is in the level after the highest level of its upstream segments
+        # so segments in a level don't depend on each other within a time step and can be run in parallel
+        seg_level = np.full(len(adj_us), -1)
+        for i in np.argsort([len(x) for x in us_segs], kind='stable'):  # upstream segments come first
+            seg_level[i] = max([seg_level[u] for u in adj_us[i]], default=-1) + 1
+        self.levels = [np.flatnonzero(seg_level == lev) for lev in range(seg_level.max() + 1)]
+
+        # gage_us[i, j] is True if gage j is upstream of segment i, gage_in_ds[i, j] is True if gage j is downstream
+        # of segment i and reg_gages_ds[i] is the number of regulated gage segments downstream of segment i
+        gage_segids = self.hydrographs['segid'].to_numpy()
+        us_rows = np.repeat(np.arange(len(us_segs)), np.diff(self.us_indptr))
+        ds_rows = np.repeat(np.arange(len(ds_segs)), np.diff(self.ds_indptr))
+        self.gage_us = np.zeros((len(us_segs), len(gage_segids)), dtype=bool)
+        self.gage_in_ds = np.zeros((len(ds_segs), len(gage_segids)), dtype=bool)
+        for j in range(len(gage_segids)):
+            self.gage_us[us_rows[self.us_indices == gage_segids[j]], j] = True
+            self.gage_in_ds[ds_rows[self.ds_indices == gage_segids[j]], j] = True
+        reg_segids = np.unique(gage_segids[self.hydrographs['regulated'].to_numpy() == 1])
+        self.reg_gages_ds = np.bincount(ds_rows[np.isin(self.ds_indices, reg_segids)], minlength=len(ds_segs))
+
+        # append column to hydrographs indicating how many other gage segments are downstream of it
+        gage_ds = np.zeros(len(gage_segids), dtype=int)
+        for j in np.flatnonzero(gage_segids != -9999):
+            gage_ds[j] = len(np.unique(gage_segids[self.gage_in_ds[gage_segids[j]]]))
 
         self.hydrographs['gage_ds'] = gage_ds
 
-        print('storing topology info')
-        # list of lists of upstream segments of each segment
-        self.us_segs = [self.nt.find_all_us(i) for i in self.network.index]
-        self.ds_segs = [self.nt.find_all_ds(i) for i in self.network.index]
+        # gage attributes and flows (gage x time step) as arrays
+        self.hydro_mat = self.hydrographs[[str(t) for t in range(1, self.hydrographs.shape[1]-3)]].to_numpy(dtype=float)
+        self.hydro_segid = self.hydrographs['segid'].to_numpy()
+        self.hydro_reg = self.hydrographs['regulated'].to_numpy() == 1
+        self.hydro_da = self.hydrographs['DA'].to_numpy(dtype=float)
+        self.hydro_gds = self.hydrographs['gage_ds'].to_numpy()
+
+        # coefficient in the drainage area - discharge relationship at each time step, averaged over the unregulated
+        # gages (or from the only gage)
+        coef_gages = ~self.hydro_reg if len(self.hydro_mat) > 1 else np.ones(1, dtype=bool)
+        self.flow_coef = np.mean(np.maximum(self.hydro_mat[coef_gages] / self.hydro_da[coef_gages, None]**self.flow_exp, 0), axis=0)
+
+        # gage_mask[i, j] is True if the flow of gage j is added to the flow of segment i: regulated gages at the
+        # segment or upstream of it with no other regulated gages in between, and unregulated gages at the segment or
+        # upstream of it. the drainage area upstream of unregulated gages is already accounted for in the gaged flow so
+        # the rest (ungaged_da) is extrapolated from the flow coefficient
+        if len(self.hydro_mat) > 1:
+            at_gage = self.hydro_segid[None, :] == np.arange(len(self.network.index))[:, None]
+            reg = self.hydro_reg & (at_gage | (self.gage_us & (self.reg_gages_ds[:, None] == self.hydro_gds[None, :])))
+            unreg = ~self.hydro_reg & (at_gage | self.gage_us)
+            self.gage_mask = (reg | unreg).astype(float)
+            self.ungaged_da = self.network['eff_DA'].to_numpy(dtype=float) - (unreg & ~at_gage) @ self.hydro_da
+        else:
+            self.ungaged_da = self.network['eff_DA'].to_numpy(dtype=float)
 
         # call model for predicting channel width
         self.width = self.get_width_model(width_table)
+        self.w_coef = self.width.coef_
+        self.w_int = self.width.intercept_
 
         # set up manning's n calculation (linear function of grain size)
         self.mannings_slope = (self.mannings_n[1] - self.mannings_n[0]) / (np.max(self.network['D_pred_mid']) - np.min(self.network['D_pred_mid']))
         self.mannings_intercept = self.mannings_slope*-np.max(self.network['D_pred_mid']) + self.mannings_n[1]
 
         # obtain number of time steps for output table
-        time = np.arange(1, self.hydrographs.shape[1]-3, 1, dtype=np.int)
-
-        # build multi-index dataframe for storing data/outputs
-        self.network = gpd.read_file(network)
-        segments = np.arange(0, len(self.network.index + 1), 1)
-
-        ydim = len(time)*len(segments)
-        zeros = np.zeros((ydim, 19))
-
-        iterables = [time, segments]
-        index = pd.MultiIndex.from_product(iterables, names=['time', 'segment'])
-
-        self.outdf = pd.DataFrame(zeros, index=index, columns=['Q', 'Qs_min', 'Qs_mid', 'Qs_max', 'Qs_out_min',
-                                                               'Qs_out_mid', 'Qs_out_max', 'CSR_min', 'CSR_mid',
-                                                               'CSR_max', 'Store_chan_min', 'Store_chan_mid', 'Store_chan_max',
-                                                               'Store_tot_min', 'Store_tot_mid', 'Store_tot_max',
-                                                               'Store_delta_min', 'Store_delta_mid', 'Store_delta_max'])  # add the names of attributes
+        time = np.arange(1, self.hydrographs.shape[1]-3, dtype=np.int64)
+
+        # segment ids for output array
+        segments = np.arange(len(self.network.index), dtype=np.int64)
+
+        # numeric network attributes as arrays indexed by segment id (state attributes are updated in place)
+        if 'denude' not in self.network.columns:
+            self.network['denude'] = 0.
+        self.net = {col: self.network[col].to_numpy(dtype=float, copy=True) for col in net_cols}
+
+        # slope and floodplain thickness state (segment x min, mid, max case), the attribute arrays are views of these
+        self.slope = np.column_stack([self.net['Slope_min'], self.net['Slope_mid'], self.net['Slope_max']])
+        self.fpt = np.column_stack([self.net['fpt_min'], self.net['fpt_mid'], self.net['fpt_max']])
+        for k, case in enumerate(['min', 'mid', 'max']):
+            self.net['Slope_' + case] = self.slope[:, k]
+            self.net['fpt_' + case] = self.fpt[:, k]
+
+        # time invariant per segment values: Manning's n (linear function of grain size), grain size (m) and critical
+        # flow for the min, mid and max cases
+        self.n = self.net['D_pred_mid'] * self.mannings_slope + self.mannings_intercept
+        self.D0 = np.column_stack([self.net['D_pred_hig'], self.net['D_pred_mid'], self.net['D_pred_low']]) / 1000.
+        self.qc = np.column_stack([self.net['Qc_low'], self.net['Qc_mid'], self.net['Qc_high']])
+        self.active_layer = self.net['w_bf']*self.net['Length_m']*0.25*self.bulk_dens  # minimum 25cm active layer...
+
+        # segments draining into a dam (next reach has lower effective drainage area), no sediment passes the dam
+        # (the next reach in the same chain as given by TopologyTools.get_next_reach, found from the reach ids in one pass)
+        rid_ix = {rid: i for i, rid in zip(self.network.index, self.network['rid'])}
+        self.next_reach = np.array([rid_ix.get(rid[:rid.rfind('.')] + '.' + str(int(rid[rid.rfind('.')+1:]) + 1), -1)
+                                    for rid in self.network['rid']], dtype=np.int64)
+        self.dam = (self.next_reach != -1) & (self.net['eff_DA'][self.next_reach] < self.net['eff_DA'])
+
+        # channel width at the critical flows for the min, mid and max cases (these don't change through time)
+        log_da = np.log(self.net['Drain_Area'])
+        self.w_crit = np.column_stack([np.column_stack([log_da, self.net[qc]**0.5]) @ self.w_coef + self.w_int
+                                       for qc in ['Qc_low', 'Qc_mid', 'Qc_high']])
+
+        # output table, time step x segment x attribute (time step 0 is unused so that rows line up with days), stored
+        # as float32 to halve its size. sediment flux out and storage (segment x case) are kept as float64 model state
+        self.out = np.zeros((len(time)+1, len(segments), len(out_cols)), dtype=np.float32)
+        self.sed_out = np.zeros((len(segments), 3))
+        self.ch_store = np.zeros((len(segments), 3))
+        if self.chan_store is not None:
+            self.ch_store[:] = self.chan_store[:, None]
+        self.tot_store = np.zeros((len(segments), 3))
+
+        # set up arrays for tracking disturbance sediment pulses (mass and distance remaining that it can travel in
+        # the time step), each segment has room for its own store plus all the pulses that can leave disturbed
+        # segments upstream
+        disturbed = self.net['dist_start'] != -9999
+        size = np.ones(len(segments), dtype=np.int64)
+        for segs in self.levels:
+            for i in segs:
+                if disturbed[i]:
+                    size[i] = 1 + sum(size[u] for u in adj_us[i] if disturbed[u])
+        self.pulse_ptr = np.concatenate([[0], np.cumsum(size)])
+        self.pulse_mass = np.zeros(self.pulse_ptr[-1])
+        self.pulse_dist = np.zeros(self.pulse_ptr[-1])
+        self.pulse_src = np.full(self.pulse_ptr[-1], -1, dtype=np.int64)
+        self.pulse_n = np.ones(len(segments), dtype=np.int64)
+        self.pulse_empty = np.ones(len(segments), dtype=bool)
+        self.pulse_total = np.zeros(len(segments))
+        self.out_mass = np.zeros(self.pulse_ptr[-1])  # pulses leaving each segment
+        self.out_dist = np.zeros(self.pulse_ptr[-1])
+        self.out_n = np.zeros(len(segments), dtype=np.int64)
+
+    @property
+    def outdf(self):
+        """
+        the model outputs as a dataframe with two index columns (time step and segment ID)
+        :return: dataframe
+        """
+        index = pd.MultiIndex.from_product([np.arange(1, self.out.shape[0]), np.arange(self.out.shape[1])],
+                                           names=['time', 'segment'])
 
-        # set up dictionaries for tracking disturbance sediment pulses
-        self.seg_dict = dict()  # mass of each sediment pulse
-        for i in self.network.index:
-            self.seg_dict[i] = [[0,0]]
-        self.out_dict = dict()  # distance remaining that it can travel in the time step
-        for i in self.network.index:
-            self.out_dict[i] = []
+        return pd.DataFrame(self.out[1:].reshape(-1, len(out_cols)), index=index, columns=out_cols)
 
     def get_width_model(self, width_table):
         """
@@ -99,797 +747,52 @@ class SerfeModel:
         """
         table = pd.read_csv(width_table, sep=',', header=0)
         table = table.dropna(axis='columns')
-        table['DA'] = np.log(table['DA'])
-        table['Q'] = np.sqrt(table['Q'])
+        X = np.column_stack([np.log(table['DA'].to_numpy(dtype=float)), np.sqrt(table['Q'].to_numpy(dtype=float))])
+        y = table['w'].to_numpy(dtype=float)
 
         # width regression
         regr = linear_model.LinearRegression()
-        regr.fit(table[['DA', 'Q']], table['w'])
-        rsq = regr.score(table[['DA', 'Q']], table['w'])
+        regr.fit(X, y)
+        rsq = regr.score(X, y)
         if rsq < 0.5:
             print('R-squared is less than 0.5, poor model fit')
 
         print('channel width regression')
         print('intercept: ' + str(regr.intercept_))
         print('coefficient: ' + str(regr.coef_))
-        print('r squared: ' + str(regr.score(table[['DA', 'Q']], table['w'])))
+        print('r squared: ' + str(rsq))
 
         return regr
 
-    def find_flow_coef(self, Q, DA):
-        """
-        finds the coefficient in the drainage area - discharge relationship to extrapolate flow values
-        :param Q: the discharge for a given time step
-        :param DA: the drainage area of the location associated with the discharge
-        :return: a coeffiecient for the drainage area - discharge relationship
-        """
-        a = max(Q / DA**self.flow_exp, 0)
-
-        return a
-
-    def get_flow(self, segid, time):
-
-        if len(self.hydrographs.index) > 1:
-            Q = []
-            eff_da = self.network.loc[segid, 'eff_DA']
-
-            r = self.hydrographs[self.hydrographs['regulated'] == 1]
-
-            for i in r.index:  # for each gage
-                if r.loc[i, 'segid'] == segid:  # if the segment id is the gage segment add flow
-                    Q.append(r.loc[i, str(time)])
-                elif r.loc[i, 'segid'] in self.us_segs[segid]:  # if gage is upstream of segment
-                    if len(list(set(self.ds_segs[segid]) & set(r['segid']))) == r.loc[i, 'gage_ds']:  # if the amount of gages ds from seg is same as ds from given gage
-                        Q.append(r.loc[i, str(time)])  # than add the stats
-
-            ur = self.hydrographs[self.hydrographs['regulated'] == 0]
-            for i in ur.index:
-                if ur.loc[i, 'segid'] == segid:
-                    Q.append(ur.loc[i, str(time)])
-                elif ur.loc[i, 'segid'] in self.us_segs[segid]:
-                    Q.append(ur.loc[i, str(time)])
-                    eff_da = eff_da - ur.loc[i, 'DA']
-
-            coefs = [self.find_flow_coef(ur.loc[x, str(time)], ur.loc[x, 'DA']) for x in ur.index]
-
-            if len(Q) == 0:
-                Q.append(0)
-
-            #eff_da = max(self.network.loc[segid, 'eff_DA'] - np.sum(eff_da), 0.01)
-            flow = np.sum(Q) + np.average(coefs)*eff_da**self.flow_exp
-
-        else:
-            coef = self.find_flow_coef(self.hydrographs.loc[self.hydrographs.index[0], str(time)], self.hydrographs.loc[self.hydrographs.index[0], 'DA'])
-            flow = coef * self.network.loc[segid, 'eff_DA']**self.flow_exp
-
-        return flow
-
-    def get_upstream_qs(self, time, segid):
+    def get_flow(self, time):
         """
-        obtains the sediment flux from the adjacent upstream segment(s)
+        estimates flow at each segment from the gage records
         :param time: time step
-        :param segid: segment ID
-        :return: sediment flux (tonnes)
+        :return: array - flow (cms) at each segment
         """
-        us_seg = self.nt.find_us_seg(segid)
-        us_seg2 = self.nt.find_us_seg2(segid)
+        q_t = self.hydro_mat[:, time-1]
 
-        if us_seg is not None:
-            usqs1_min = self.outdf.loc[(time, us_seg), 'Qs_out_min']
-            usqs1_mid = self.outdf.loc[(time, us_seg), 'Qs_out_mid']
-            usqs1_max = self.outdf.loc[(time, us_seg), 'Qs_out_max']
-        else:
-            usqs1_min, usqs1_mid, usqs1_max = 0., 0., 0.
-
-        if us_seg2 is not None:
-            usqs2_min = self.outdf.loc[(time, us_seg2), 'Qs_out_min']
-            usqs2_mid = self.outdf.loc[(time, us_seg2), 'Qs_out_mid']
-            usqs2_max = self.outdf.loc[(time, us_seg2), 'Qs_out_max']
-        else:
-            usqs2_min, usqs2_mid, usqs2_max = 0., 0., 0.
-
-        usqs_tot_min = usqs1_min + usqs2_min
-        usqs_tot_mid = usqs1_mid + usqs2_mid
-        usqs_tot_max = usqs1_max + usqs2_max
-
-        return usqs_tot_min, usqs_tot_mid, usqs_tot_max
-
-    def get_direct_qs(self, segid):
-        """
-        obtains the hillslope sediment delivery
-        :param segid: segment ID
-        :return: sediment flux (tonnes)
-        """
-        # assume sediment bulk density
-        sed_density = 2.6  # tonne/m^3
-
-        # calculate delivery from denudation rate
-        hillslope_da = self.network.loc[segid, 'direct_DA'] - (self.network.loc[segid, 'fp_area']/1000000.)
-        if hillslope_da < 0:
-            hillslope_da = self.network.loc[segid, 'direct_DA']*0.5
-        vol_sed = ((self.network.loc[segid, 'denude']/1000.)/365.)*(hillslope_da*1000000.)  # m^3; assumes daily time step
-        dir_qs = vol_sed * sed_density
-
-        return dir_qs
-
-    def transport_capacity(self, Q, w, S, D, om_crit_star):
-        """
-        calculates bedload transport capacity using Lammers and Bledsoe 2018
-        :param Q: flow (cms)
-        :param w: channel width
-        :param S: bed slope
-        :param D: median grain size
-        :return: bedload transport capacity (tonnes)
-        """
-        # variables
-        rho = 1000.
-        rho_s = 2650.
-        g = 9.8
-        om_crit = om_crit_star * g * (rho_s - rho) * np.sqrt(((rho_s - rho)/rho) * g * D**3)
-
-        # determine if stream power exceeds critical threshold
-        om = (rho * g * Q * S) / w
-
-        if om > om_crit:
-            rate_tot = 0.0214 * (om - om_crit) ** (3. / 2.) * D ** (-1) * (Q / w) ** (-5. / 6.)  # Lammers et al total load equation (tonnes)
-            cap_tot = (Q * 86400) * (rate_tot / 1000000.) * 2.6  # convert ppm to tonnes/day
-            rate_bl = 0.000143 * (om - om_crit) ** (3. / 2.) * D ** (-0.5) * (Q / w) ** (-0.5)
-            cap_bl = rate_bl * w * 86400. / 1000.  # convert to tonnes/day
-        else:
-            cap_tot = 0.
-            cap_bl = 0
-
-        return cap_tot  # add in bl stuff later
-
-    def update_seg_dict(self, segid, vel):
-        def takeSecond(elem):
-            return elem[1]
-
-        # add up stores left over from previous time step, attribute new distance based on flow velocity
-        store_tot = []
-        for i in self.seg_dict[segid]:
-            store_tot.append(i[0])
-        store_sum = np.sum(store_tot)
-        if store_sum < 0:
-            store_sum = 0
-        elif store_sum is None:
-            store_sum = 0
-        self.seg_dict[segid] = [[store_sum, vel*86400-self.network.loc[segid, 'Length_m']]]
-
-        us_seg = self.nt.find_us_seg(segid)
-        us_seg2 = self.nt.find_us_seg2(segid)
-        if us_seg is not None:
-            for x in self.out_dict[us_seg]:
-                self.seg_dict[segid].append(x)
-        if us_seg2 is not None:
-            for x in self.out_dict[us_seg2]:
-                self.seg_dict[segid].append(x)
-
-        self.seg_dict[segid].sort(key=takeSecond)
-
-        new_store_tot = []
-        for j in self.seg_dict[segid]:
-            new_store_tot.append(j[0])
-        if np.sum(new_store_tot) == 0:
-            self.seg_dict[segid] = [[0,0]]
-
-        return
-
-    def pulse_propagate(self, segid, transport):  # make it so this calculates qs_out and adjusts transport cap for transport of non fine sed when fine is gone
-        qs_out = 0
-
-        if self.seg_dict[segid] != [[0,0]]:
-            self.out_dict[segid] = []
-            if transport > 0:
-                for i in self.seg_dict[segid]:
-                    if transport >= i[0]:
-                        if i[1] - self.network.loc[segid, 'Length_m'] > 0:
-                            self.out_dict[segid].append([i[0], i[1] - self.network.loc[segid, 'Length_m']])
-                            qs_out += i[0]
-                            i[0] = 0
-                            transport = transport - i[0]
-                        else:
-                            pass
-
-                    else:
-                        self.out_dict[segid].append([transport, i[1] - self.network.loc[segid, 'Length_m']])
-                        qs_out += transport
-                        i[0] = i[0] - transport
-                        transport = 0
-
-            # get rid of any zero values in seg_dict
-            #for x in self.seg_dict[segid]:
-            #    if x[0] == 0:
-            #        self.seg_dict[segid].remove(self.seg_dict[segid][x])
-        else:
-            transport = transport
-
-        return qs_out, transport  # this value is used to adjust sed supply for model logic...
-
-    def apply_to_reach(self, segid, time):
-        """
-        applies the SeRFE logic to a given reach
-        :param segid: segment ID
-        :param time: time step
-        :return:
-        """
-
-        # get flow at reach at given time step
-        flow = self.get_flow(segid, time)
-
-        # get channel width of reach at given time step
-        da = np.log(self.network.loc[segid, 'Drain_Area'])
-        q = np.sqrt(flow)
-        w_inputs = np.array([da, q])
-        w = max(self.width.predict([w_inputs])[0], 0.5)  # 0.5 m min width
-        if self.network.loc[segid, 'confine'] == 1:
-            if w > self.network.loc[segid, 'w_bf']:
-                w = self.network.loc[segid, 'w_bf']
-
-        # mannings n calculation of depth
-        n = self.network.loc[segid, 'D_pred_mid'] * self.mannings_slope + self.mannings_intercept
+        flow = self.flow_coef[time-1] * self.ungaged_da**self.flow_exp
+        if len(q_t) > 1:
+            flow = self.gage_mask @ q_t + flow
 
-        depth_min = ((n * flow) / (w * self.network.loc[segid, 'Slope_min']**0.5))**0.6
-        depth_mid = ((n * flow) / (w * self.network.loc[segid, 'Slope_mid']**0.5))**0.6
-        depth_max = ((n * flow) / (w * self.network.loc[segid, 'Slope_max']**0.5))**0.6
-
-        # find upstream qs input
-        qs_us_min, qs_us_mid, qs_us_max = self.get_upstream_qs(time, segid)
-
-        # find direct qs input (hillslopes)
-        qs_dir = self.get_direct_qs(segid)  # tonnes
-
-        if self.network.loc[segid, 'fp_area'] != 0.:
-            if self.network.loc[segid, 'direct_DA'] <= 3:  # logic to sure trib contributions not in network go to channel
-                qs_channel = qs_dir*self.network.loc[segid, 'confine']
-                qs_fp = qs_dir - qs_channel  # tonnes
-            else:
-                qs_channel = max(0.8*qs_dir, qs_dir*self.network.loc[segid, 'confine'])
-                qs_fp = qs_dir - qs_channel
-            fp_store_min = ((self.network.loc[segid, 'fp_area']*self.network.loc[segid, 'fpt_min'])*self.bulk_dens) + qs_fp
-            fp_store_mid = ((self.network.loc[segid, 'fp_area']*self.network.loc[segid, 'fpt_mid'])*self.bulk_dens) + qs_fp
-            fp_store_max = ((self.network.loc[segid, 'fp_area']*self.network.loc[segid, 'fpt_max'])*self.bulk_dens) + qs_fp
-            delta_fp_thick = qs_fp / self.network.loc[segid, 'fp_area'] * (1 / self.bulk_dens)
-            fp_thick_min = self.network.loc[segid, 'fpt_min'] + delta_fp_thick  # meters
-            fp_thick_mid = self.network.loc[segid, 'fpt_mid'] + delta_fp_thick
-            fp_thick_max = self.network.loc[segid, 'fpt_max'] + delta_fp_thick
-
-        else:
-            qs_channel = qs_dir
-            fp_store_min, fp_store_mid, fp_store_max = 0., 0., 0.
-            fp_thick_min, fp_thick_mid, fp_thick_max = 0., 0., 0.
-
-        # if its during disturbance period keep track of sediment pulse mass
-        if self.network.loc[segid, 'dist_start'] != -9999:
-            if self.network.loc[segid, 'dist_start'] <= time:
-                self.seg_dict[segid].append([qs_channel, 0])
-                vel = (depth_mid ** (2 / 3) * self.network.loc[segid, 'Slope_mid'] ** 0.5) / n
-                self.update_seg_dict(segid, vel)
-
-        if time == 1:
-            if self.chan_store is not None:
-                prev_ch_store_min = self.chan_store[segid]
-                prev_ch_store_mid = self.chan_store[segid]
-                prev_ch_store_max = self.chan_store[segid]
-            else:
-                prev_ch_store_min = 0
-                prev_ch_store_mid = 0
-                prev_ch_store_max = 0
-        else:
-            prev_ch_store_min = self.outdf.loc[(time-1, segid), 'Store_chan_min']
-            prev_ch_store_mid = self.outdf.loc[(time-1, segid), 'Store_chan_mid']
-            prev_ch_store_max = self.outdf.loc[(time-1, segid), 'Store_chan_max']
-
-        # find transport capacity (including uncertainty in critical dimensionless stream power)
-        S_min = self.network.loc[segid, 'Slope_min']
-        S_mid = self.network.loc[segid, 'Slope_mid']
-        S_max = self.network.loc[segid, 'Slope_max']
-        # if there's fine sediment inputs in the channel adjust D based on proportional volume
-        if self.network.loc[segid, 'dist_start'] != -9999:
-            if self.network.loc[segid, 'dist_start'] <= time:
-                fine_tot = []
-                for i in self.seg_dict[segid]:
-                    fine_tot.append(i[0])
-                if np.sum(fine_tot) > 0:
-                    fine_ratio_mid = np.sum(fine_tot)/(np.sum(fine_tot) + max(prev_ch_store_mid-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens))  # minimum 25cm active layer...
-                    coarse_ratio_mid = max(prev_ch_store_mid-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens)/(max(prev_ch_store_mid-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens)+np.sum(fine_tot))
-                    fine_ratio_min = np.sum(fine_tot)/(np.sum(fine_tot) + max(prev_ch_store_min-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens))
-                    coarse_ratio_min = max(prev_ch_store_min-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens)/(max(prev_ch_store_min-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens)+np.sum(fine_tot))
-                    fine_ratio_max = np.sum(fine_tot)/(np.sum(fine_tot) + max(prev_ch_store_max-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens))
-                    coarse_ratio_max = max(prev_ch_store_max-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens)/(max(prev_ch_store_max-np.sum(fine_tot), self.network.loc[segid, 'w_bf']*self.network.loc[segid, 'Length_m']*0.25*self.bulk_dens)+np.sum(fine_tot))
-
-                    D_mid = (self.network.loc[segid, 'D_pred_mid']*coarse_ratio_mid + self.network.loc[segid, 'dist_d50']*fine_ratio_mid) / 1000.
-                    D_low = (self.network.loc[segid, 'D_pred_low']*coarse_ratio_max + self.network.loc[segid, 'dist_d50']*fine_ratio_max) / 1000.
-                    D_high = (self.network.loc[segid, 'D_pred_hig']*coarse_ratio_min + self.network.loc[segid, 'dist_d50']*fine_ratio_min) / 1000.
-                else:
-                    D_mid = self.network.loc[segid, 'D_pred_mid'] / 1000.
-                    D_low = self.network.loc[segid, 'D_pred_low'] / 1000.
-                    D_high = self.network.loc[segid, 'D_pred_hig'] / 1000.
-            else:
-                D_mid = self.network.loc[segid, 'D_pred_mid'] / 1000.
-                D_low = self.network.loc[segid, 'D_pred_low'] / 1000.
-                D_high = self.network.loc[segid, 'D_pred_hig'] / 1000.
-        else:
-            D_mid = self.network.loc[segid, 'D_pred_mid'] / 1000.
-            D_low = self.network.loc[segid, 'D_pred_low'] / 1000.
-            D_high = self.network.loc[segid, 'D_pred_hig'] / 1000.
-        cap_min = self.transport_capacity(flow, min(w, self.network.loc[segid, 'w_bf']), S_min, D_high, 0.11)
-        cap_mid = self.transport_capacity(flow, min(w, self.network.loc[segid, 'w_bf']), S_mid, D_mid, 0.1)
-        cap_max = self.transport_capacity(flow, min(w, self.network.loc[segid, 'w_bf']), S_max, D_low, 0.09)
-
-        # apply transport/routing logic
-
-        # mig_rate (could change this to just find critical unit SP using dimensionless critical SP = 0.1...)
-        w_crit_min = self.width.predict([np.array([np.log(self.network.loc[segid, 'Drain_Area']), self.network.loc[segid, 'Qc_low']**0.5])])[0]
-        w_crit_mid = self.width.predict([np.array([np.log(self.network.loc[segid, 'Drain_Area']), self.network.loc[segid, 'Qc_mid']**0.5])])[0]
-        w_crit_max = self.width.predict([np.array([np.log(self.network.loc[segid, 'Drain_Area']), self.network.loc[segid, 'Qc_high']**0.5])])[0]
-        sp_crit_min = (9810 * self.network.loc[segid, 'Qc_low'] * S_min) / w_crit_min
-        sp_crit_mid = (9810 * self.network.loc[segid, 'Qc_mid'] * S_mid) / w_crit_mid
-        sp_crit_max = (9810 * self.network.loc[segid, 'Qc_high'] * S_max) / w_crit_max
-
-        excess_sp_min = float(((9810*flow*S_min)/w) - sp_crit_min*4.2)
-        if excess_sp_min <= 0:
-            mig_rate_min = 0
-        else:
-            wc = sp_crit_min * 4.2  # 1.2 is soil critical sp param, MAKE THIS PARAM
-            k = 4.49E-6 + 1.74E-7*wc - 4.56E-6*self.network.loc[segid, 'Sinuos']
-            mig_rate_min = k*excess_sp_min **0.5
-        excess_sp_mid = float(((9810*flow*S_mid)/w) - sp_crit_mid*4.2)
-        if excess_sp_mid <= 0:
-            mig_rate_mid = 0
-        else:
-            wc = sp_crit_mid * 4.2
-            k = 4.49E-6 + 1.74E-7*wc - 4.56E-6*self.network.loc[segid, 'Sinuos']
-            mig_rate_mid = k*excess_sp_mid **0.5
-        excess_sp_max = float(((9810*flow*S_max)/w) - sp_crit_max*4.2)
-        if excess_sp_max <= 0:
-            mig_rate_max = 0
-        else:
-            wc = sp_crit_max * 4.2
-            k = 4.49E-6 + 1.74E-7*wc - 4.56E-6*self.network.loc[segid, 'Sinuos']
-            mig_rate_max = k*excess_sp_max **0.5
-
-        if self.network.loc[segid, 'dist_start'] != -9999:
-            if self.network.loc[segid, 'dist_start'] <= time:
-                qsout_min, transport_rem_min = self.pulse_propagate(segid, cap_min)
-                qsout_max, transport_rem_max = self.pulse_propagate(segid, cap_max)
-                qsout_mid, transport_rem_mid = self.pulse_propagate(segid, cap_mid)
-            else:
-                transport_rem_min = cap_min
-                transport_rem_mid = cap_mid
-                transport_rem_max = cap_max
-                qsout_min, qsout_mid, qsout_max = 0, 0, 0
-        else:
-            transport_rem_min = cap_min
-            transport_rem_mid = cap_mid
-            transport_rem_max = cap_max
-            qsout_min, qsout_mid, qsout_max = 0, 0, 0
-
-
-        # LOW CAPACITY CASE
-        # if REMAINING capacity is < all inputs MINUS fine sediment out
-        if transport_rem_min < (qs_channel + qs_us_min + prev_ch_store_min)-qsout_min:  # greater sediment load than transport capacity
-            qs_out = transport_rem_min + qsout_min
-            if self.network.loc[segid, 'confine'] != 1.:  # segment is unconfined
-                if depth_min < fp_thick_min:  # depth is less than floodplain height
-                    channel_store = (qs_channel + qs_us_min + prev_ch_store_min) - qs_out
-                    delta_h = ((channel_store - prev_ch_store_min) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_min'] = self.network.loc[segid, 'Slope_min'] + (delta_h/self.network.loc[segid, 'Length_m'])
-                else:  # depth is greater than floodplain height
-                    vol_channel = depth_min * self.network.loc[segid, 'Length_m'] * min(w, self.network.loc[segid, 'w_bf'])
-                    vol_fp = (depth_min - fp_thick_min)*self.network.loc[segid, 'fp_area']
-                    v_chan = (depth_min ** (2 / 3) * S_min ** 0.5) / n
-                    v_fp = ((depth_min - fp_thick_min) ** (2 / 3) * S_min ** 0.5) / self.fp_n
-                    v_ratio = v_fp / v_chan
-                    fp_ratio = vol_fp*v_ratio / ((vol_channel + vol_fp)-(vol_fp*v_ratio)) # correct volumes for velocity
-                    sed_remain = (qs_channel + qs_us_min + prev_ch_store_min) - qs_out
-                    channel_store = sed_remain * (1-fp_ratio)
-                    delta_h = ((channel_store - prev_ch_store_min) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_min'] = self.network.loc[segid, 'Slope_min'] + (delta_h/self.network.loc[segid, 'Length_m'])
-                    fp_store_min = fp_store_min + (sed_remain - channel_store)
-                    fp_thick_min = fp_store_min / self.network.loc[segid, 'fp_area'] * (1/self.bulk_dens)
-            else:  # segment is confined
-                channel_store = (qs_channel + qs_us_min + prev_ch_store_min) - qs_out
-                delta_h = ((channel_store - prev_ch_store_min) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                self.network.loc[segid, 'Slope_min'] = self.network.loc[segid, 'Slope_min'] + (delta_h/self.network.loc[segid, 'Length_m'])
-
-            if (qs_channel + qs_us_min + prev_ch_store_min) == 0:
-                if cap_min > 0:
-                    csr = cap_min
-                else:
-                    csr = 1
-            else:
-                csr = cap_min / (qs_channel + qs_us_min + prev_ch_store_min)
-
-        elif transport_rem_min > (qs_channel + qs_us_min + prev_ch_store_min)-qsout_min:  # greater transport capacity than sediment load
-            if self.network.loc[segid, 'confine'] != 1.:  # segment is unconfined
-                fp_recr = min((mig_rate_min * 86400) * (self.network.loc[segid, 'Length_m'] * (1 - self.network.loc[segid, 'confine'])) * fp_thick_min * self.bulk_dens, self.network.loc[segid, 'fp_area'] * self.network.loc[segid, 'fpt_min'] * self.bulk_dens)  # set up as 1 DAY TIME STEP
-                if depth_min < fp_thick_min:
-                    qs_out = (qs_channel + qs_us_min + prev_ch_store_min) + fp_recr + qsout_min
-                    fp_store_min = fp_store_min - fp_recr
-                    channel_store = 0.
-                    delta_h = ((channel_store - prev_ch_store_min) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_min'] = self.network.loc[segid, 'Slope_min'] + (delta_h/self.network.loc[segid, 'Length_m'])
-                    # update fp area...?  if i hold width constant that the change is storage should be represented by lower fp surface (see how line 166 elevates it.
-                    fp_recr_thick = fp_recr / self.network.loc[segid, 'fp_area'] * (1/self.bulk_dens)
-                    fp_thick_min = max(0, fp_thick_min - fp_recr_thick)
-                else:
-                    vol_channel = depth_min * self.network.loc[segid, 'Length_m'] * min(w, self.network.loc[segid, 'w_bf'])
-                    vol_fp = (depth_min - fp_thick_min) * self.network.loc[segid, 'fp_area']
-                    v_chan = (depth_min ** (2 / 3) * S_min ** 0.5) / n
-                    v_fp = ((depth_min - fp_thick_min) ** (2 / 3) * S_min ** 0.5) / self.fp_n
-                    v_ratio = v_fp / v_chan
-                    fp_ratio = vol_fp * v_ratio / ((vol_channel + vol_fp) - (vol_fp * v_ratio))  # correct volumes for velocity
-                    w_s = (16.17*0.0008**2)/(1.8e-5+(12.1275*0.0008**3)**0.5)  # suspended grain size 0.8mm for this trajectory
-                    fp_v_ratio = min(w_s/v_fp, 0.01)  # 1 percent minimum
-                    fp_recr = fp_recr - (qs_us_min*fp_ratio*fp_v_ratio)
-                    qs_out = (qs_channel + qs_us_min + prev_ch_store_min) + fp_recr + qsout_min
-                    fp_store_min = fp_store_min - fp_recr
-                    channel_store = 0.
-                    delta_h = ((channel_store - prev_ch_store_min) * (1 / self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_min'] = self.network.loc[segid, 'Slope_min'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                    # update fp area...?  if i hold width constant that the change is storage should be represented by lower fp surface (see how line 166 elevates it.
-                    fp_recr_thick = fp_recr / self.network.loc[segid, 'fp_area'] * (1 / self.bulk_dens)
-                    fp_thick_min = max(0, fp_thick_min - fp_recr_thick)
-
-                if (qs_channel + qs_us_min + prev_ch_store_min + fp_recr) == 0:
-                    if cap_min > 0:
-                        csr = cap_min
-                    else:
-                        csr = 1
-                else:
-                    csr = cap_min / (qs_channel + qs_us_min + prev_ch_store_min + fp_recr)
-
-            else:  # segment is confined
-                channel_store = 0.
-                delta_h = ((channel_store - prev_ch_store_min) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                self.network.loc[segid, 'Slope_min'] = self.network.loc[segid, 'Slope_min'] + (delta_h/self.network.loc[segid, 'Length_m'])
-                qs_out = (qs_channel + qs_us_min + prev_ch_store_min) + qsout_min
-
-                if (qs_channel + qs_us_min + prev_ch_store_min) == 0:
-                    if cap_min > 0:
-                        csr = cap_min
-                    else:
-                        csr = 1
-                else:
-                    csr = cap_min / (qs_channel + qs_us_min + prev_ch_store_min)
-
-        else:  # sediment load equals transport capacity
-            qs_out = qs_channel + qs_us_min + prev_ch_store_min
-            channel_store = 0.
-            csr = 1.
-
-        # if you are at a dam, qs_out = 0
-        next_reach = self.nt.get_next_reach(segid)
-        if next_reach is not None:
-            if self.network.loc[next_reach, 'eff_DA'] < self.network.loc[segid, 'eff_DA']:
-                qs_out = 0.
-
-        store_tot = channel_store + fp_store_min
-
-        if self.network.loc[segid, 'confine'] != 1.:
-            self.network.loc[segid, 'fpt_min'] = fp_thick_min
-
-        # update output table
-        self.outdf.loc[(time, segid), 'Q'] = flow
-        self.outdf.loc[(time, segid), 'Qs_min'] = qs_channel + qs_us_min + prev_ch_store_min
-        self.outdf.loc[(time, segid), 'Qs_out_min'] = qs_out
-        self.outdf.loc[(time, segid), 'CSR_min'] = csr
-        self.outdf.loc[(time, segid), 'Store_tot_min'] = store_tot
-        self.outdf.loc[(time, segid), 'Store_chan_min'] = channel_store
-        if time > 1:
-            self.outdf.loc[(time, segid), 'Store_delta_min'] = store_tot - (self.outdf.loc[(time-1, segid), 'Store_tot_min'])
-        else:
-            self.outdf.loc[(time, segid), 'Store_delta_min'] = 0  # this is wrong channel storage can change day 1
-
-        # MID CAPACITY CASE
-        if transport_rem_mid < (qs_channel + qs_us_mid + prev_ch_store_mid) - qsout_mid:  # greater sediment load than transport capacity
-            qs_out = cap_mid + qsout_mid
-            if self.network.loc[segid, 'confine'] != 1.:  # segment is unconfined
-                if depth_mid < fp_thick_mid:  # depth is less than floodplain height
-                    channel_store = (qs_channel + qs_us_mid + prev_ch_store_mid) - qs_out
-                    delta_h = ((channel_store - prev_ch_store_mid) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_mid'] = self.network.loc[segid, 'Slope_mid'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                else:  # depth is greater than floodplain height
-                    vol_channel = depth_mid * self.network.loc[segid, 'Length_m'] * min(w, self.network.loc[segid, 'w_bf'])
-                    vol_fp = (depth_mid - fp_thick_mid) * self.network.loc[segid, 'fp_area']
-                    v_chan = (depth_mid ** (2 / 3) * S_mid ** 0.5) / n
-                    v_fp = ((depth_mid - fp_thick_mid) ** (2 / 3) * S_mid ** 0.5) / self.fp_n
-                    v_ratio = v_fp / v_chan
-                    fp_ratio = vol_fp * v_ratio / ((vol_channel + vol_fp) - (vol_fp * v_ratio))  # correct volumes for velocity
-                    sed_remain = (qs_channel + qs_us_mid + prev_ch_store_mid) - qs_out
-                    channel_store = sed_remain * (1 - fp_ratio)
-                    delta_h = ((channel_store - prev_ch_store_mid) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_mid'] = self.network.loc[segid, 'Slope_mid'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                    fp_store_mid = fp_store_mid + (sed_remain - channel_store)
-                    fp_thick_mid = fp_store_mid / self.network.loc[segid, 'fp_area'] * (1/self.bulk_dens)
-            else:  # segment is confined
-                channel_store = (qs_channel + qs_us_mid + prev_ch_store_mid) - qs_out
-                delta_h = ((channel_store - prev_ch_store_mid) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                self.network.loc[segid, 'Slope_mid'] = self.network.loc[segid, 'Slope_mid'] + (delta_h / self.network.loc[segid, 'Length_m'])
-
-            if (qs_channel + qs_us_mid + prev_ch_store_mid) == 0:
-                if cap_mid > 0:
-                    csr = cap_mid
-                else:
-                    csr = 1
-            else:
-                csr = cap_mid / (qs_channel + qs_us_mid + prev_ch_store_mid)
-
-        elif transport_rem_mid > (qs_channel + qs_us_mid + prev_ch_store_mid) - qsout_mid:  # greater transport capacity than sediment load
-            if self.network.loc[segid, 'confine'] != 1.:  # segment is unconfined
-                fp_recr = min((mig_rate_mid * 86400) * (self.network.loc[segid, 'Length_m'] * (
-                            1 - self.network.loc[segid, 'confine'])) * fp_thick_mid * self.bulk_dens,
-                              self.network.loc[segid, 'fp_area'] * self.network.loc[
-                                  segid, 'fpt_mid'] * self.bulk_dens)  # set up as 1 DAY TIME STEP
-                if depth_mid < fp_thick_mid:
-                    qs_out = (qs_channel + qs_us_mid + prev_ch_store_mid) + fp_recr + qsout_mid
-                    fp_store_mid = fp_store_mid - fp_recr
-                    channel_store = 0.
-                    delta_h = ((channel_store - prev_ch_store_mid) * (1 / self.bulk_dens)) / (
-                                0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_mid'] = self.network.loc[segid, 'Slope_mid'] + (
-                                delta_h / self.network.loc[segid, 'Length_m'])
-                    # update fp area...?  if i hold width constant that the change is storage should be represented by lower fp surface (see how line 166 elevates it.
-                    fp_recr_thick = fp_recr / self.network.loc[segid, 'fp_area'] * (1 / self.bulk_dens)
-                    fp_thick_mid = max(0, fp_thick_mid - fp_recr_thick)
-                else:
-                    vol_channel = depth_mid * self.network.loc[segid, 'Length_m'] * min(w, self.network.loc[segid, 'w_bf'])
-                    vol_fp = (depth_mid - fp_thick_mid) * self.network.loc[segid, 'fp_area']
-                    v_chan = (depth_mid ** (2 / 3) * S_mid ** 0.5) / n
-                    v_fp = ((depth_mid - fp_thick_mid) ** (2 / 3) * S_mid ** 0.5) / self.fp_n
-                    v_ratio = v_fp / v_chan
-                    fp_ratio = vol_fp * v_ratio / ((vol_channel + vol_fp) - (vol_fp * v_ratio))  # correct volumes for velocity
-                    w_s = (16.17 * 0.0005 ** 2) / (1.8e-5 + (12.1275 * 0.0005 ** 3) ** 0.5)  # suspended grain size 0.5mm for this trajectory
-                    fp_v_ratio = min(w_s / v_fp, 0.01)  # 1 percent minimum
-                    fp_recr = fp_recr - (qs_us_min * fp_ratio * fp_v_ratio)
-                    qs_out = (qs_channel + qs_us_mid + prev_ch_store_mid) + fp_recr + qsout_mid
-                    fp_store_mid = fp_store_mid - fp_recr
-                    channel_store = 0.
-                    delta_h = ((channel_store - prev_ch_store_mid) * (1 / self.bulk_dens)) / (
-                                0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_mid'] = self.network.loc[segid, 'Slope_mid'] + (
-                                delta_h / self.network.loc[segid, 'Length_m'])
-                    # update fp area...?  if i hold width constant that the change is storage should be represented by lower fp surface (see how line 166 elevates it.
-                    fp_recr_thick = fp_recr / self.network.loc[segid, 'fp_area'] * (1 / self.bulk_dens)
-                    fp_thick_mid = max(0, fp_thick_mid - fp_recr_thick)
-
-                if (qs_channel + qs_us_mid + prev_ch_store_mid + fp_recr) == 0:
-                    if cap_mid > 0:
-                        csr = cap_mid
-                    else:
-                        csr = 1
-                else:
-                    csr = cap_mid / (qs_channel + qs_us_mid + prev_ch_store_mid + fp_recr)
-
-            else:  # segment is confined
-                channel_store = 0.
-                delta_h = ((channel_store - prev_ch_store_mid) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                self.network.loc[segid, 'Slope_mid'] = self.network.loc[segid, 'Slope_mid'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                qs_out = (qs_channel + qs_us_mid + prev_ch_store_mid) + qsout_mid
-
-                if (qs_channel + qs_us_mid + prev_ch_store_mid) == 0:
-                    if cap_mid > 0:
-                        csr = cap_mid
-                    else:
-                        csr = 1
-                else:
-                    csr = cap_mid / (qs_channel + qs_us_mid + prev_ch_store_mid)
-
-        else:  # sediment load equals transport capacity
-            qs_out = qs_channel + qs_us_mid + prev_ch_store_mid
-            channel_store = 0.
-            csr = 1.
-
-        # if you are at a dam, qs_out = 0
-        next_reach = self.nt.get_next_reach(segid)
-        if next_reach is not None:
-            if self.network.loc[next_reach, 'eff_DA'] < self.network.loc[segid, 'eff_DA']:
-                qs_out = 0.
-
-        store_tot = channel_store + fp_store_mid
-
-        if self.network.loc[segid, 'confine'] != 1.:
-            self.network.loc[segid, 'fpt_mid'] = fp_thick_mid
-
-            # update output table
-        self.outdf.loc[(time, segid), 'Qs_mid'] = qs_channel + qs_us_mid + prev_ch_store_mid
-        self.outdf.loc[(time, segid), 'Qs_out_mid'] = qs_out
-        self.outdf.loc[(time, segid), 'CSR_mid'] = csr
-        self.outdf.loc[(time, segid), 'Store_tot_mid'] = store_tot
-        self.outdf.loc[(time, segid), 'Store_chan_mid'] = channel_store
-        if time > 1:
-            self.outdf.loc[(time, segid), 'Store_delta_mid'] = store_tot - (self.outdf.loc[(time - 1, segid), 'Store_tot_mid'])
-        else:
-            self.outdf.loc[(time, segid), 'Store_delta_mid'] = 0
-
-        # HIGH CAPACITY CASE
-        if transport_rem_max < (qs_channel + qs_us_max + prev_ch_store_max) - qsout_max:  # greater sediment load than transport capacity
-            qs_out = cap_max + qsout_max
-            if self.network.loc[segid, 'confine'] != 1.:  # segment is unconfined
-                if depth_max < fp_thick_max:  # depth is less than floodplain height
-                    channel_store = (qs_channel + qs_us_max + prev_ch_store_max) - qs_out
-                    delta_h = ((channel_store - prev_ch_store_max) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_max'] = self.network.loc[segid, 'Slope_max'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                else:  # depth is greater than floodplain height
-                    vol_channel = depth_max * self.network.loc[segid, 'Length_m'] * min(w, self.network.loc[segid, 'w_bf'])
-                    vol_fp = (depth_max - fp_thick_max) * self.network.loc[segid, 'fp_area']
-                    v_chan = (depth_max ** (2 / 3) * S_max ** 0.5) / n
-                    v_fp = ((depth_max - fp_thick_max) ** (2 / 3) * S_max ** 0.5) / self.fp_n
-                    v_ratio = v_fp / v_chan
-                    fp_ratio = vol_fp * v_ratio / ((vol_channel + vol_fp) - (vol_fp * v_ratio))  # correct volumes for velocity
-                    sed_remain = (qs_channel + qs_us_max + prev_ch_store_max) - qs_out
-                    channel_store = sed_remain * (1 - fp_ratio)
-                    delta_h = ((channel_store - prev_ch_store_max) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_max'] = self.network.loc[segid, 'Slope_max'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                    fp_store_max = fp_store_max + (sed_remain - channel_store)
-                    fp_thick_max = fp_store_max / self.network.loc[segid, 'fp_area'] * (1/self.bulk_dens)
-            else:  # segment is confined
-                channel_store = (qs_channel + qs_us_max + prev_ch_store_max) - qs_out
-                delta_h = ((channel_store - prev_ch_store_max) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                self.network.loc[segid, 'Slope_max'] = self.network.loc[segid, 'Slope_max'] + (delta_h / self.network.loc[segid, 'Length_m'])
-
-            if (qs_channel + qs_us_max + prev_ch_store_max) == 0:
-                if cap_max > 0:
-                    csr = cap_max
-                else:
-                    csr = 1
-            else:
-                csr = cap_max / (qs_channel + qs_us_max + prev_ch_store_max)
-
-        elif transport_rem_max > (qs_channel + qs_us_max + prev_ch_store_max) - qsout_max:  # greater transport capacity than sediment load
-            if self.network.loc[segid, 'confine'] != 1.:  # segment is unconfined
-                fp_recr = min((mig_rate_max * 86400) * (self.network.loc[segid, 'Length_m'] * (
-                            1 - self.network.loc[segid, 'confine'])) * fp_thick_max * self.bulk_dens,
-                              self.network.loc[segid, 'fp_area'] * self.network.loc[
-                                  segid, 'fpt_max'] * self.bulk_dens)  # set up as 1 DAY TIME STEP
-                if depth_max < fp_thick_max:
-                    qs_out = (qs_channel + qs_us_max + prev_ch_store_max) + fp_recr + qsout_max
-                    fp_store_max = fp_store_max - fp_recr
-                    channel_store = 0.
-                    delta_h = ((channel_store - prev_ch_store_max) * (1 / self.bulk_dens)) / (
-                                0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_max'] = self.network.loc[segid, 'Slope_max'] + (
-                                delta_h / self.network.loc[segid, 'Length_m'])
-                    # update fp area...?  if i hold width constant that the change is storage should be represented by lower fp surface (see how line 166 elevates it.
-                    fp_recr_thick = fp_recr / self.network.loc[segid, 'fp_area'] * (1 / self.bulk_dens)
-                    fp_thick_max = max(0, fp_thick_max - fp_recr_thick)
-                else:
-                    vol_channel = depth_max * self.network.loc[segid, 'Length_m'] * min(w, self.network.loc[segid, 'w_bf'])
-                    vol_fp = (depth_max - fp_thick_max) * self.network.loc[segid, 'fp_area']
-                    v_chan = (depth_max ** (2 / 3) * S_max ** 0.5) / n
-                    v_fp = ((depth_max - fp_thick_max) ** (2 / 3) * S_max ** 0.5) / self.fp_n
-                    v_ratio = v_fp / v_chan
-                    fp_ratio = vol_fp * v_ratio / ((vol_channel + vol_fp) - (vol_fp * v_ratio))  # correct volumes for velocity
-                    w_s = (16.17 * 0.0003 ** 2) / (1.8e-5 + (12.1275 * 0.0003 ** 3) ** 0.5)  # suspended grain size 0.3mm for this trajectory
-                    fp_v_ratio = min(w_s / v_fp, 0.01)  # 1 percent minimum
-                    fp_recr = fp_recr - (qs_us_min * fp_ratio * fp_v_ratio)
-                    qs_out = (qs_channel + qs_us_max + prev_ch_store_max) + fp_recr + qsout_max
-                    fp_store_max = fp_store_max - fp_recr
-                    channel_store = 0.
-                    delta_h = ((channel_store - prev_ch_store_max) * (1 / self.bulk_dens)) / (
-                                0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                    self.network.loc[segid, 'Slope_max'] = self.network.loc[segid, 'Slope_max'] + (
-                                delta_h / self.network.loc[segid, 'Length_m'])
-                    # update fp area...?  if i hold width constant that the change is storage should be represented by lower fp surface (see how line 166 elevates it.
-                    fp_recr_thick = fp_recr / self.network.loc[segid, 'fp_area'] * (1 / self.bulk_dens)
-                    fp_thick_max = max(0, fp_thick_max - fp_recr_thick)
-
-                if (qs_channel + qs_us_max + prev_ch_store_max + fp_recr) == 0:
-                    if cap_max > 0:
-                        csr = cap_max
-                    else:
-                        csr = 1
-                else:
-                    csr = cap_max / (qs_channel + qs_us_max + prev_ch_store_max + fp_recr)
-
-            else:  # segment is confined
-                channel_store = 0.
-                delta_h = ((channel_store - prev_ch_store_max) * (1/self.bulk_dens)) / (0.5 * self.network.loc[segid, 'w_bf'] * self.network.loc[segid, 'Length_m'])
-                self.network.loc[segid, 'Slope_max'] = self.network.loc[segid, 'Slope_max'] + (delta_h / self.network.loc[segid, 'Length_m'])
-                qs_out = (qs_channel + qs_us_max + prev_ch_store_max) + qsout_max
-
-                if (qs_channel + qs_us_max + prev_ch_store_max) == 0:
-                    if cap_max > 0:
-                        csr = cap_max
-                    else:
-                        csr = 1
-                else:
-                    csr = cap_max / (qs_channel + qs_us_max + prev_ch_store_max)
-
-        else:  # sediment load equals transport capacity
-            qs_out = qs_channel + qs_us_max + prev_ch_store_max
-            channel_store = 0.
-            csr = 1.
-
-        # if you are at a dam, qs_out = 0
-        next_reach = self.nt.get_next_reach(segid)
-        if next_reach is not None:
-            if self.network.loc[next_reach, 'eff_DA'] < self.network.loc[segid, 'eff_DA']:
-                qs_out = 0.
-
-        store_tot = channel_store + fp_store_max
-
-        if self.network.loc[segid, 'confine'] != 1.:
-            self.network.loc[segid, 'fpt_max'] = fp_thick_max
-
-            # update output table
-        self.outdf.loc[(time, segid), 'Qs_max'] = qs_channel + qs_us_max + prev_ch_store_max
-        self.outdf.loc[(time, segid), 'Qs_out_max'] = qs_out
-        self.outdf.loc[(time, segid), 'CSR_max'] = csr
-        self.outdf.loc[(time, segid), 'Store_tot_max'] = store_tot
-        self.outdf.loc[(time, segid), 'Store_chan_max'] = channel_store
-        if time > 1:
-            self.outdf.loc[(time, segid), 'Store_delta_max'] = store_tot - (self.outdf.loc[(time - 1, segid), 'Store_tot_max'])
-        else:
-            self.outdf.loc[(time, segid), 'Store_delta_max'] = 0
-
-        return
-
-    def run_first_order(self, time):
-        """
-        runs the model for all first order stream segments
-        :param time: time step
-        :return:
-        """
-        seg = self.nt.seg_id_from_rid('1.1')
-        time = time
-
-        while seg is not None:
-            self.apply_to_reach(seg, time)
-
-            next_reach = self.nt.get_next_reach(seg)
-
-            if next_reach is not None:
-                if self.network.loc[next_reach, 'confluence'] == 1:
-                    next_reach = self.nt.get_next_chain(next_reach)
-
-            else:
-                next_reach = self.nt.get_next_chain(seg)
-
-            seg = next_reach
-
-        return
+        return flow
 
-    def run_below_confluences(self, time):
+    def run_level(self, segs, time, flow):
         """
-        runs the model for all stream segments below confluences (greater than first order)
+        runs the model for a level of stream segments (segments that don't drain into each other)
+        :param segs: array - segment IDs
         :param time: time step
+        :param flow: array - flow (cms) at each segment at the time step
         :return:
         """
-        conf_list = self.network[self.network['confluence'] == 1].index
-        da_vals = [self.network.loc[i, 'Drain_Area'] for i in conf_list]
-
-        sort = np.argsort(da_vals)
-        conf_list = [conf_list[i] for i in sort]
-
-        while len(conf_list) > 0:
-            for x in conf_list:
-                seg = x
-                us = self.nt.find_us_seg(seg)
-                us2 = self.nt.find_us_seg2(seg)
-
-                if self.outdf.loc[(time, us), 'Qs_out_mid'] == -9999 or self.outdf.loc[(time, us2), 'Qs_out_mid'] == -9999:
-                    pass
-                else:
-                    time = time
-
-                    while seg is not None:
-                        self.apply_to_reach(seg, time)
-
-                        next_reach = self.nt.get_next_reach(seg)
-
-                        if next_reach is not None:
-                            if self.network.loc[next_reach, 'confluence'] == 1:
-                                next_reach = None
-                            else:
-                                pass
-                        else:
-                            pass
-
-                        seg = next_reach
-
-                    conf_list.remove(x)
+        route_level(segs, time, flow, self.out, self.slope, self.fpt, self.sed_out, self.ch_store, self.tot_store,
+                    self.net['Drain_Area'], self.net['confine'], self.net['w_bf'], self.net['fp_area'],
+                    self.net['direct_DA'], self.net['denude'], self.net['Length_m'], self.net['dist_start'],
+                    self.net['dist_d50'], self.net['Sinuos'], self.n, self.D0, self.qc, self.w_crit, self.active_layer,
+                    self.us1, self.us2, self.w_coef, self.w_int, self.dam, self.bulk_dens, self.fp_n, self.pulse_ptr,
+                    self.pulse_mass, self.pulse_dist, self.pulse_src, self.pulse_n, self.pulse_empty, self.pulse_total,
+                    self.out_mass, self.out_dist, self.out_n)
 
         return
 
@@ -902,48 +805,40 @@ class SerfeModel:
         total_t = self.hydrographs.shape[1]-4
         time = 1
 
+        # disturbance period of each segment as whole days (first day and the day after the last day)
+        has_dist = self.net['dist_start'] != -9999
+        dist_first = self.net['dist_start'].astype(int)
+        dist_stop = (self.net['dist_end'] + 1).astype(int)
+
         while time <= total_t:
             print('day ' + str(time))
 
-            # set qs_out initially to -9999
-            for i in range(len(self.outdf.index.levels[1])):
-                self.outdf.loc[(time, i), 'Qs_out_min'] = -9999
-                self.outdf.loc[(time, i), 'Qs_out_mid'] = -9999
-                self.outdf.loc[(time, i), 'Qs_out_max'] = -9999
-
-            # apply denudation rate to each segment
-            for i in self.network.index:
-                if self.network.loc[i, 'dist_start'] != -9999:
-                    if time in range(int(self.network.loc[i, 'dist_start']), int((self.network.loc[i, 'dist_end']+1))):
-                        self.network.loc[i, 'denude'] = np.random.gamma(self.network.loc[i, 'dist_g_sh'], self.network.loc[i, 'dist_g_sc'])
-                    else:
-                        self.network.loc[i, 'denude'] = np.random.gamma(self.network.loc[i, 'g_shape'], self.network.loc[i, 'g_scale'])
-                else:
-                    self.network.loc[i, 'denude'] = np.random.gamma(self.network.loc[i, 'g_shape'], self.network.loc[i, 'g_scale'])
-
-            # run the model for given time step
-            print('running first order')
-            self.run_first_order(time)
+            # apply denudation rate to each segment (disturbance parameters during disturbance period)
+            disturbed = has_dist & (time >= dist_first) & (time < dist_stop)
+            self.net['denude'] = self.rng.gamma(np.where(disturbed, self.net['dist_g_sh'], self.net['g_shape']),
+                                                np.where(disturbed, self.net['dist_g_sc'], self.net['g_scale']))
 
-            print('running below confluences')
-            self.run_below_confluences(time)
+            # run the model for given time step, level by level from the headwaters down
+            flow = self.get_flow(time)
+            for segs in self.levels:
+                self.run_level(segs, time, flow)
 
             time += 1
             # reset denude rates to -9999, do I need to do this or will it just overwrite?
 
+        # write updated state attributes back to the network
+        for col in ['denude', 'Slope_min', 'Slope_mid', 'Slope_max', 'fpt_min', 'fpt_mid', 'fpt_max']:
+            self.network[col] = self.net[col]
+
         if spinup:
-            for i in self.network.index:
-                self.network.loc[i, 'Slope_min'] = self.network.loc[i, 'Slope_mid']
-                self.network.loc[i, 'Slope_max'] = self.network.loc[i, 'Slope_mid']
-                self.network.loc[i, 'fpt_min'] = self.network.loc[i, 'fpt_mid']
-                self.network.loc[i, 'fpt_max'] = self.network.loc[i, 'fpt_mid']
+            self.network['Slope_min'] = self.network['Slope_mid'].to_numpy(copy=True)
+            self.network['Slope_max'] = self.network['Slope_mid'].to_numpy(copy=True)
+            self.network['fpt_min'] = self.network['fpt_mid'].to_numpy(copy=True)
+            self.network['fpt_max'] = self.network['fpt_mid'].to_numpy(copy=True)
 
             self.network.to_file(self.streams)
 
-            chan_stor = []
-            for x in self.outdf.index.levels[1]:
-                val = self.outdf.loc[(total_t, x), 'Store_chan_mid']
-                chan_stor.append(val)
+            chan_stor = self.ch_store[:, 1].tolist()
 
             return chan_stor
 
@@ -1,5 +1,6 @@
-import geopandas as gpd
-from shapely.geometry import LineString
+import numpy as np
+import shapely
+from .vector_io import read_vector, write_vector, tile_valley
 
 
 def extract_floodplain_area(network, floodplain, lg_buf=1500, med_buf=500, sm_buf=50):
@@ -13,8 +14,8 @@ def extract_floodplain_area(network, floodplain, lg_buf=1500, med_buf=500, sm_bu
     :return:
     """
 
-    dn = gpd.read_file(network)
-    fp = gpd.read_file(floodplain)
+    dn = read_vector(network)
+    fp = read_vector(floodplain)
 
     if len(fp.index) > 1:
         raise Exception('valley/floodplain polygon must be merged into single feature')
@@ -24,34 +25,25 @@ def extract_floodplain_area(network, floodplain, lg_buf=1500, med_buf=500, sm_bu
         if att not in dn.columns:
             raise Exception('input network does not contain all necessary attributes (Drain_Area, w_bf, Length_m)')
 
-    fp_areas = []
+    # straight line between the endpoints of each segment, buffered by a distance set by drainage area
+    ept1 = shapely.get_coordinates(shapely.get_point(dn.geometry.values, 0))
+    ept2 = shapely.get_coordinates(shapely.get_point(dn.geometry.values, -1))
+    lines = shapely.linestrings(np.stack([ept1, ept2], axis=1))
 
-    for i in dn.index:
-        seg = dn.loc[i]
-        da = seg['Drain_Area']
-        geom = seg['geometry']
+    # drainage area bins: < 25 small, 25 - 250 medium, >= 250 large
+    buf_dist = np.array([sm_buf, med_buf, lg_buf])[np.digitize(dn['Drain_Area'].to_numpy(), [25, 250])]
+    bufs = shapely.buffer(lines, buf_dist, cap_style='flat')
 
-        print('segment ', i+1, ' of ', len(dn.index))
+    # split floodplain into tiles and intersect each buffer with only the tiles it falls on
+    tiles = tile_valley(fp, dn.length.mean() + 2*max(lg_buf, med_buf, sm_buf))
+    seg_ids, tile_ids = shapely.STRtree(tiles.geometry.values).query(bufs, predicate='intersects')
+    inters = shapely.intersection(bufs[seg_ids], tiles.geometry.values[tile_ids])
+    inters_area = np.bincount(seg_ids, weights=shapely.area(inters), minlength=len(dn.index))
 
-        ept1 = (geom.boundary[0].xy[0][0], geom.boundary[0].xy[1][0])
-        ept2 = (geom.boundary[1].xy[0][0], geom.boundary[1].xy[1][0])
-        line = LineString([ept1, ept2])
+    fp_areas = np.maximum(inters_area - (dn['w_bf'].to_numpy() * dn['Length_m'].to_numpy()), 0.)
 
-        if da >= 250:
-            buf = line.buffer(lg_buf, cap_style=2)
-        elif da < 250 and da >= 25:
-            buf = line.buffer(med_buf, cap_style=2)
-        else:
-            buf = line.buffer(sm_buf, cap_style=2)
+    dn['fp_area'] = fp_areas.astype(np.float32)  # derived stat, single precision is plenty
 
-        inters = buf.intersection(fp.loc[0, 'geometry'])  # make sure valley is single part
-        fpa = inters.area - (seg['w_bf']*seg['Length_m'])
-        if fpa < 0:
-            fpa = 0
-        fp_areas.append(fpa)
-
-    dn['fp_area'] = fp_areas
-
-    dn.to_file(network)
+    write_vector(dn, network)
 
     return
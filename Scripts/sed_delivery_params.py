@@ -1,12 +1,45 @@
 # imports
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import geopandas as gpd
 import rasterio
-from shapely.geometry import LineString
+from rasterio.windows import Window
+import shapely
 from scipy.signal import convolve2d
 import numpy as np
 from rasterstats import zonal_stats
 
 
+def slope_window(dem, window):
+    """
+    Finds the slope of one window of a DEM using partial derivative method.
+    :param dem: string - path to a digital elevation raster.
+    :param window: rasterio Window - the part of the DEM to process.
+    :return: array - slope (degrees) of the window, in the data type of the DEM.
+    """
+    with rasterio.open(dem, 'r') as src:
+        dtype = src.dtypes[0]
+        xres = src.res[0]
+        yres = src.res[1]
+
+        # the 3x3 kernel needs a one cell halo; cells outside of the DEM are filled with 1
+        halo = Window(window.col_off - 1, window.row_off - 1, window.width + 2, window.height + 2)
+        arr = src.read(1, window=halo, boundless=True, fill_value=1)
+
+    x = np.array([[-1 / (8 * xres), 0, 1 / (8 * xres)],
+                  [-2 / (8 * xres), 0, 2 / (8 * xres)],
+                  [-1 / (8 * xres), 0, 1 / (8 * xres)]])
+    y = np.array([[1 / (8 * yres), 2 / (8 * yres), 1 / (8 * yres)],
+                  [0, 0, 0],
+                  [-1 / (8 * yres), -2 / (8 * yres), -1 / (8 * yres)]])
+
+    x_grad = convolve2d(arr, x, mode='valid')
+    y_grad = convolve2d(arr, y, mode='valid')
+    slope = np.arctan(np.sqrt(x_grad ** 2 + y_grad ** 2)) * (180. / np.pi)
+
+    return slope.astype(dtype)
+
+
 class SedDeliveryParams:
 
     def __init__(self, dem, slope_out, network, neighborhood, g_shape, g_scale_min, g_scale_max, calc_slope=False):
@@ -23,63 +56,46 @@ class SedDeliveryParams:
             self.slope()
         self.get_gamma_vals()
 
-    def slope(self):  # convolve 2d runs out of memory on large arrays...
+    def slope(self, tile_size=1024):
         """
-        Finds the slope using partial derivative method
-        :param dem: path to a digital elevation raster
+        Finds the slope using partial derivative method. The DEM is split into windows which are processed in
+        parallel so that the whole raster never has to be held in memory.
+        :param tile_size: int - number of rows and columns in each window. Default = 1024.
         :return: a slope raster saved to location of dem
         """
         with rasterio.open(self.dem, 'r') as src:
             meta = src.profile
-            dtype = src.dtypes[0]
-            arr = src.read()[0, :, :]
-
-            xres = src.res[0]
-            yres = src.res[1]
+            height, width = src.height, src.width
 
-        x = np.array([[-1 / (8 * xres), 0, 1 / (8 * xres)],
-                      [-2 / (8 * xres), 0, 2 / (8 * xres)],
-                      [-1 / (8 * xres), 0, 1 / (8 * xres)]])
-        y = np.array([[1 / (8 * yres), 2 / (8 * yres), 1 / (8 * yres)],
-                      [0, 0, 0],
-                      [-1 / (8 * yres), -2 / (8 * yres), -1 / (8 * yres)]])
+        meta.update(tiled=True, blockxsize=256, blockysize=256)
 
-        x_grad = convolve2d(arr, x, mode='same', boundary='fill', fillvalue=1)
-        y_grad = convolve2d(arr, y, mode='same', boundary='fill', fillvalue=1)
-        slope = np.arctan(np.sqrt(x_grad ** 2 + y_grad ** 2)) * (180. / np.pi)
-        slope = slope.astype(dtype)
+        windows = [Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+                   for row in range(0, height, tile_size) for col in range(0, width, tile_size)]
 
         with rasterio.open(self.slope_out, 'w', **meta) as dst:
-            dst.write(slope, 1)
+            with ProcessPoolExecutor() as pool:
+                for window, slope in zip(windows, pool.map(slope_window, repeat(self.dem), windows)):
+                    dst.write(slope, 1, window=window)
 
         return
 
     def get_gamma_vals(self):
 
-        ave_slope = []
-
-        for i in self.dn.index:
-            seg = self.dn.loc[i]
-            geom = seg['geometry']
-
-            print('segment ', i+1, ' of ', len(self.dn))
-
-            ept1 = (geom.boundary[0].xy[0][0], geom.boundary[0].xy[1][0])
-            ept2 = (geom.boundary[1].xy[0][0], geom.boundary[1].xy[1][0])
-            line = LineString([ept1, ept2])
-
-            buf = line.buffer(self.neighborhood, cap_style=2)
-
-            zs = zonal_stats(buf, self.slope_out, stats='mean')
-            mean = zs[0].get('mean')
-
-            ave_slope.append(mean)
-
-        l_slope = (self.g_scale_max - self.g_scale_min)/(max(ave_slope) - min(ave_slope))
-        g_scale = []
-        for i in range(len(ave_slope)):
-            g = ave_slope[i] * l_slope + self.g_scale_min
-            g_scale.append(g)
+        # straight line between the endpoints of each segment, buffered by the neighborhood distance
+        ept1 = shapely.get_coordinates(shapely.get_point(self.dn.geometry.values, 0))
+        ept2 = shapely.get_coordinates(shapely.get_point(self.dn.geometry.values, -1))
+        bufs = shapely.buffer(shapely.linestrings(np.stack([ept1, ept2], axis=1)), self.neighborhood, cap_style='flat')
+
+        # mean slope within every buffer from a single pass over the slope raster
+        zs = zonal_stats(bufs, self.slope_out, stats='mean')
+        ave_slope = np.array([z.get('mean') for z in zs], dtype=float)
+        missing = np.flatnonzero(np.isnan(ave_slope))
+        if len(missing) > 0:
+            raise Exception('slope raster does not cover the neighborhood of segments ' +
+                            ', '.join(str(i) for i in self.dn.index[missing]) + ', check the DEM extent')
+
+        l_slope = (self.g_scale_max - self.g_scale_min)/(ave_slope.max() - ave_slope.min())
+        g_scale = ave_slope * l_slope + self.g_scale_min
 
         self.dn['g_shape'] = self.g_shape
         self.dn['g_scale'] = g_scale
@@ -0,0 +1,94 @@
+# imports
+import os
+import sqlite3
+import numpy as np
+import geopandas as gpd
+import pyogrio
+import shapely
+
+# arrow streaming needs pyarrow (and GDAL >= 3.6), fall back to pyogrio's numpy reader without it
+try:
+    import pyarrow
+    use_arrow = True
+except ImportError:
+    use_arrow = False
+
+# file extensions for the indexed formats that shapefile inputs can be converted to
+indexed_formats = {'GPKG': '.gpkg', 'FlatGeobuf': '.fgb'}
+
+
+def read_vector(path):
+    """
+    Reads a vector dataset (e.g. drainage network or valley bottom shapefile) into a GeoDataFrame using pyogrio.
+    :param path: string - path to the vector dataset.
+    :return: GeoDataFrame
+    """
+
+    return gpd.read_file(path, engine='pyogrio', use_arrow=use_arrow)
+
+
+def write_vector(gdf, path):
+    """
+    Writes a GeoDataFrame (e.g. the attributed drainage network) to a vector dataset in a single batch using pyogrio.
+    GeoPackage outputs are written with a spatial index.
+    :param gdf: GeoDataFrame - data to write.
+    :param path: string - path to the output vector dataset, the driver is inferred from the extension.
+    :return:
+    """
+
+    if os.path.splitext(path)[1].lower() == '.gpkg':
+        pyogrio.write_dataframe(gdf, path, use_arrow=use_arrow, SPATIAL_INDEX='YES')
+    else:
+        pyogrio.write_dataframe(gdf, path, use_arrow=use_arrow)
+
+    return
+
+
+def prepare_inputs(path, driver='GPKG'):
+    """
+    Converts a shapefile to a spatially indexed GeoPackage or FlatGeobuf saved next to it. The conversion is done
+    once and reused on later runs unless the shapefile has been modified since.
+    :param path: string - path to the vector dataset.
+    :param driver: string - 'GPKG' (default) or 'FlatGeobuf'.
+    :return: string - path to the indexed dataset (the input path is returned unchanged if it is not a shapefile).
+    """
+
+    base, ext = os.path.splitext(path)
+    if ext.lower() != '.shp':
+        return path
+
+    out = base + indexed_formats[driver]
+    if not os.path.exists(out) or os.path.getmtime(out) < os.path.getmtime(path):
+        pyogrio.write_dataframe(read_vector(path), out, driver=driver, use_arrow=use_arrow, SPATIAL_INDEX='YES')
+
+        if driver == 'GPKG':
+            con = sqlite3.connect(out)
+            rtree = con.execute("SELECT name FROM sqlite_master WHERE name LIKE 'rtree_%'").fetchall()
+            con.close()
+            if len(rtree) == 0:
+                print('spatial index was not created for ' + out + ' (GDAL/SQLite built without rtree)')
+
+    return out
+
+
+def tile_valley(valley, tile_size):
+    """
+    Splits valley bottom polygon(s) into a grid of square tiles so that each network segment is only intersected with
+    the pieces of valley bottom around it rather than the whole (often very large and complex) polygon.
+    :param valley: GeoDataFrame - valley bottom polygon(s).
+    :param tile_size: float - edge length of the tiles (map units).
+    :return: GeoDataFrame - valley bottom pieces, one single part polygon per row.
+    """
+
+    xmin, ymin, xmax, ymax = valley.total_bounds
+    nb_col = max(int(np.ceil((xmax - xmin) / tile_size)), 1)
+    nb_row = max(int(np.ceil((ymax - ymin) / tile_size)), 1)
+    x0, y0 = np.meshgrid(xmin + np.arange(nb_col) * tile_size, ymin + np.arange(nb_row) * tile_size)
+    x0, y0 = x0.ravel(), y0.ravel()
+    grid = gpd.GeoDataFrame(geometry=shapely.box(x0, y0, x0 + tile_size, y0 + tile_size), crs=valley.crs)
+
+    # merge all valley bottom parts into one (multi)polygon so overlapping parts don't produce duplicate pieces
+    valley_u = gpd.GeoDataFrame(geometry=[shapely.union_all(valley.geometry.values)], crs=valley.crs)
+    tiles = gpd.overlay(valley_u, grid, how='intersection', keep_geom_type=True)
+
+    return tiles.explode(index_parts=False).reset_index(drop=True)